@@ -6,10 +6,20 @@
 
 import os
 import json
+import hashlib
 import subprocess
 import sys
+import argparse
+import glob
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from itertools import repeat
 from pathlib import Path
 import requests
+from requests.adapters import HTTPAdapter
+from requests_toolbelt.multipart.encoder import MultipartEncoder
+from urllib3.util.retry import Retry
 import csv
 from datetime import datetime
 
@@ -19,6 +29,50 @@ VIDEO_EXTENSIONS = {'.mp4', '.mkv', '.avi', '.mov', '.wmv', '.flv', '.webm', '.m
 AUDIO_EXTENSIONS = {'.mp3', '.wav', '.m4a', '.ogg', '.flac', '.aac', '.wma'}
 # OpenAI API 支援的音訊格式
 OPENAI_SUPPORTED_FORMATS = {'.flac', '.m4a', '.mp3', '.mp4', '.mpeg', '.mpga', '.oga', '.ogg', '.wav', '.webm'}
+# 同時處理的檔案數（API 呼叫以網路等待為主，可多執行緒並行）
+DEFAULT_MAX_WORKERS = 4
+# 大型音訊分割後，同時上傳轉錄的片段數上限
+MAX_SEGMENT_WORKERS = 6
+
+# 多執行緒處理時避免輸出交錯
+print_lock = threading.Lock()
+
+
+def log(message: str):
+    """在 print_lock 保護下輸出（供工作執行緒使用）"""
+    with print_lock:
+        print(message)
+
+# 使用的轉錄模型（同時作為快取鍵的一部分，換模型時快取自動失效）
+TRANSCRIBE_MODEL = 'gpt-4o-transcribe-diarize'
+# 轉錄結果快取目錄：以音訊內容的 SHA-256 為鍵，重跑相同音訊時不必再呼叫付費 API
+CACHE_DIR = Path.home() / '.cache' / 'transcribe_gpt4o'
+
+# API 暫時性錯誤（速率限制、伺服器錯誤）的重試設定
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+MAX_API_RETRIES = 5
+
+# 所有 API 呼叫共用同一個 Session，重複使用 keep-alive 連線，省去每次的 TCP + TLS 交握
+SESSION = requests.Session()
+
+
+def configure_session(max_workers: int = 1):
+    """
+    依同時轉錄的檔案數設定連線池：每個檔案最多 MAX_SEGMENT_WORKERS 個片段同時上傳，
+    池的大小須涵蓋全部並行請求，否則多出的連線用完即被丟棄、下次又要重新交握
+    """
+    SESSION.mount('https://', HTTPAdapter(
+        pool_connections=1,
+        pool_maxsize=max_workers * MAX_SEGMENT_WORKERS,
+        # 萬一並行數超過池的大小，等待空出的連線而不是另開用完即丟的連線
+        pool_block=True,
+        # 這裡只重試連線階段的錯誤：串流上傳的 body 送出後無法倒帶重送，
+        # 429/5xx 由 transcribe_audio_gpt4o 重新建立請求後自行重試
+        max_retries=Retry(total=MAX_API_RETRIES, connect=MAX_API_RETRIES, read=0, status=0, backoff_factor=1)
+    ))
+
+
+configure_session()
 
 
 def load_api_key(config_path: str) -> str:
@@ -46,6 +100,63 @@ def get_media_files(input_dir: str) -> list:
     return media_files
 
 
+def probe_audio_stream(media_path: Path) -> dict:
+    """使用 ffprobe 取得第一條音軌的編碼格式、位元率、取樣率與聲道數，無法判斷時回傳空 dict"""
+    cmd = [
+        'ffprobe',
+        '-v', 'error',
+        '-select_streams', 'a:0',
+        '-show_entries', 'stream=codec_name,bit_rate,sample_rate,channels',
+        '-of', 'json',
+        str(media_path)
+    ]
+    
+    try:
+        result = subprocess.run(cmd, capture_output=True, text=True, encoding='utf-8', errors='replace')
+        streams = json.loads(result.stdout or '{}').get('streams', [])
+    except (OSError, ValueError):
+        return {}
+    
+    return streams[0] if streams else {}
+
+
+# 重新編碼為 16kHz 單聲道 128kbps AAC：每 10 分鐘約 9.6MB，分割後的片段必定低於 25MB
+AUDIO_ENCODE_ARGS = [
+    '-acodec', 'aac',  # 使用 aac 編碼
+    '-b:a', '128k',  # 位元率
+    '-ar', '16000',  # 取樣率（OpenAI 建議 16kHz）
+    '-ac', '1',  # 單聲道
+]
+
+# 直接複製 AAC 音軌的上限（超過任一項就重新編碼）
+MAX_COPY_BIT_RATE = 128000
+MAX_COPY_SAMPLE_RATE = 48000
+MAX_COPY_CHANNELS = 2
+
+
+def _to_int(value) -> int:
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return 0
+
+
+def get_audio_codec_args(media_path: Path) -> list:
+    """來源已是位元率、取樣率與聲道數都在範圍內的 AAC 時直接複製音軌（不重新編碼），否則重新編碼"""
+    stream = probe_audio_stream(media_path)
+    bit_rate = _to_int(stream.get('bit_rate'))
+    sample_rate = _to_int(stream.get('sample_rate'))
+    channels = _to_int(stream.get('channels'))
+    
+    # 任一項無法取得（如部分 mkv 不標示音軌位元率）時一律重新編碼
+    if (stream.get('codec_name') == 'aac'
+            and 0 < bit_rate <= MAX_COPY_BIT_RATE
+            and 0 < sample_rate <= MAX_COPY_SAMPLE_RATE
+            and 0 < channels <= MAX_COPY_CHANNELS):
+        return ['-c:a', 'copy']
+    return AUDIO_ENCODE_ARGS
+
+
 def extract_audio_from_video(video_path: Path, output_dir: Path) -> Path:
     """使用 ffmpeg 從影片中提取音訊"""
     # 輸出為 m4a 格式，使用 Windows 內建的 aac 編碼器
@@ -59,14 +170,12 @@ def extract_audio_from_video(video_path: Path, output_dir: Path) -> Path:
     
     try:
         # 使用 ffmpeg 提取音訊（使用 Windows MediaFoundation AAC 編碼器）
+        # 音軌已是 AAC 時直接 stream copy，比重新編碼快一個數量級
         cmd = [
             'ffmpeg',
             '-i', str(video_path),
             '-vn',  # 不處理影片
-            '-acodec', 'aac',  # 使用 aac 編碼
-            '-b:a', '128k',  # 位元率
-            '-ar', '16000',  # 取樣率（OpenAI 建議 16kHz）
-            '-ac', '1',  # 單聲道
+            *get_audio_codec_args(video_path),
             '-y',  # 覆蓋輸出檔案
             str(audio_path)
         ]
@@ -99,9 +208,82 @@ def extract_audio_from_video(video_path: Path, output_dir: Path) -> Path:
 
 def format_time(seconds: float) -> str:
     """將秒數格式化為 MM:SS 格式"""
-    minutes = int(seconds // 60)
-    secs = int(seconds % 60)
-    return f"{minutes:02d}:{secs:02d}"
+    secs = int(seconds)
+    return f"{secs // 60:02d}:{secs % 60:02d}"
+
+
+def _sha256_file(path: Path) -> str:
+    """以串流方式計算檔案的 SHA-256，記憶體用量與檔案大小無關"""
+    with open(path, 'rb') as f:
+        # Python 3.11+：file_digest 直接讀入緩衝區並在雜湊時釋放 GIL
+        if hasattr(hashlib, 'file_digest'):
+            return hashlib.file_digest(f, 'sha256').hexdigest()
+        h = hashlib.sha256()
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            h.update(chunk)
+        return h.hexdigest()
+
+
+def get_cache_path(audio_path: Path) -> Path:
+    """取得音訊檔對應的轉錄快取路徑（依模型與音訊內容雜湊）"""
+    key = _sha256_file(audio_path)
+    return CACHE_DIR / TRANSCRIBE_MODEL / key[:2] / f'{key}.json'
+
+
+def save_cached_response(cache_path: Path, result: dict):
+    """將 API 回應寫入快取；寫入失敗不影響轉錄結果"""
+    try:
+        cache_path.parent.mkdir(parents=True, exist_ok=True)
+        # 先寫暫存檔再改名，避免並行寫入或中斷時留下不完整的 JSON
+        tmp_path = cache_path.with_suffix(f'.{threading.get_ident()}.tmp')
+        tmp_path.write_text(json.dumps(result, ensure_ascii=False), encoding='utf-8')
+        os.replace(tmp_path, cache_path)
+    except OSError as e:
+        log(f"  無法寫入轉錄快取: {e}")
+
+
+def parse_diarized_response(result: dict) -> dict:
+    """將 diarized_json 格式的 API 回應轉為統一的轉錄結果"""
+    # 解析 diarized_json 格式的回應
+    segments = []
+    full_text_parts = []
+    max_end_time = 0
+    
+    # diarized_json 格式會回傳 segments 陣列
+    raw_segments = result.get('segments', [])
+    
+    for seg in raw_segments:
+        start = seg.get('start', 0)
+        end = seg.get('end', 0)
+        speaker = seg.get('speaker', 'Speaker')
+        text = seg.get('transcript', seg.get('text', ''))
+        
+        segments.append({
+            'start': start,
+            'end': end,
+            'speaker': speaker,
+            'text': text
+        })
+        
+        full_text_parts.append(text)
+        max_end_time = max(max_end_time, end)
+    
+    # 如果沒有 segments，嘗試取得純文字
+    if not segments and result.get('text'):
+        full_text = result.get('text', '')
+    else:
+        full_text = ' '.join(full_text_parts)
+    
+    # 取得偵測到的語言
+    detected_language = result.get('language', 'unknown')
+    
+    return {
+        'success': True,
+        'text': full_text,
+        'segments': segments,
+        'language': detected_language,
+        'duration': max_end_time
+    }
 
 
 def transcribe_audio_gpt4o(audio_path: Path, api_key: str) -> dict:
@@ -121,147 +303,115 @@ def transcribe_audio_gpt4o(audio_path: Path, api_key: str) -> dict:
     max_size = 25 * 1024 * 1024  # 25MB
     
     if file_size > max_size:
-        print(f"  警告：檔案大小 ({file_size / 1024 / 1024:.2f}MB) 超過 25MB 限制")
-        print(f"  需要分割檔案處理...")
+        log(f"  警告：檔案大小 ({file_size / 1024 / 1024:.2f}MB) 超過 25MB 限制")
+        log(f"  需要分割檔案處理...")
         return transcribe_large_audio(audio_path, api_key)
     
+    # 相同音訊已轉錄過則直接使用快取（分割後的片段也會各自快取，重跑時可續傳）
+    cache_path = get_cache_path(audio_path)
+    if cache_path.exists():
+        try:
+            result = json.loads(cache_path.read_text(encoding='utf-8'))
+            log(f"  使用快取的轉錄結果: {audio_path.name}")
+            return parse_diarized_response(result)
+        except (OSError, ValueError) as e:
+            log(f"  轉錄快取損毀，重新轉錄: {e}")
+    
     try:
-        with open(audio_path, 'rb') as audio_file:
-            files = {
-                'file': (audio_path.name, audio_file, 'audio/mp4')
-            }
-            data = {
-                'model': 'gpt-4o-transcribe-diarize',  # 使用 GPT-4o 語者分離轉錄模型，非 Whisper
-                'response_format': 'diarized_json',  # 使用帶時間戳記的 JSON 格式
-                'chunking_strategy': 'auto'  # 語者分離模型必須的參數
-                # 不指定 language，讓 API 自動偵測語言
+        log(f"  正在使用 GPT-4o-transcribe-diarize API 轉錄（含時間戳記）...")
+
+        for attempt in range(MAX_API_RETRIES + 1):
+            with open(audio_path, 'rb') as audio_file:
+                # 使用 MultipartEncoder 串流上傳，檔案直接從磁碟讀出送上 socket，
+                # 不需先把整個音訊檔組成 multipart body 放在記憶體中
+                encoder = MultipartEncoder(fields={
+                    'file': (audio_path.name, audio_file, 'audio/mp4'),
+                    'model': TRANSCRIBE_MODEL,  # 使用 GPT-4o 語者分離轉錄模型，非 Whisper
+                    'response_format': 'diarized_json',  # 使用帶時間戳記的 JSON 格式
+                    'chunking_strategy': 'auto'  # 語者分離模型必須的參數
+                    # 不指定 language，讓 API 自動偵測語言
+                })
+
+                response = SESSION.post(
+                    url,
+                    headers={**headers, 'Content-Type': encoder.content_type},
+                    data=encoder,
+                    timeout=600  # 10 分鐘超時
+                )
+
+            if response.status_code not in RETRY_STATUS_CODES or attempt == MAX_API_RETRIES:
+                break
+
+            # 指數退避，若伺服器有提供 Retry-After 則以其為準
+            retry_after = response.headers.get('Retry-After', '')
+            wait = float(retry_after) if retry_after.isdigit() else 2 ** attempt
+            log(f"  API 暫時性錯誤 ({response.status_code})，{wait:.0f} 秒後重試 ({attempt + 1}/{MAX_API_RETRIES})...")
+            time.sleep(wait)
+
+        if response.status_code == 200:
+            result = response.json()
+            save_cached_response(cache_path, result)
+            return parse_diarized_response(result)
+        else:
+            error_msg = response.json().get('error', {}).get('message', response.text)
+            log(f"  API 錯誤 ({response.status_code}): {error_msg}")
+            return {
+                'success': False,
+                'error': error_msg
             }
             
-            print(f"  正在使用 GPT-4o-transcribe-diarize API 轉錄（含時間戳記）...")
-            
-            response = requests.post(
-                url,
-                headers=headers,
-                files=files,
-                data=data,
-                timeout=600  # 10 分鐘超時
-            )
-            
-            if response.status_code == 200:
-                result = response.json()
-                
-                # 解析 diarized_json 格式的回應
-                segments = []
-                full_text_parts = []
-                max_end_time = 0
-                
-                # diarized_json 格式會回傳 segments 陣列
-                raw_segments = result.get('segments', [])
-                
-                for seg in raw_segments:
-                    start = seg.get('start', 0)
-                    end = seg.get('end', 0)
-                    speaker = seg.get('speaker', 'Speaker')
-                    text = seg.get('transcript', seg.get('text', ''))
-                    
-                    segments.append({
-                        'start': start,
-                        'end': end,
-                        'speaker': speaker,
-                        'text': text
-                    })
-                    
-                    full_text_parts.append(text)
-                    max_end_time = max(max_end_time, end)
-                
-                # 如果沒有 segments，嘗試取得純文字
-                if not segments and result.get('text'):
-                    full_text = result.get('text', '')
-                else:
-                    full_text = ' '.join(full_text_parts)
-                
-                # 取得偵測到的語言
-                detected_language = result.get('language', 'unknown')
-                
-                return {
-                    'success': True,
-                    'text': full_text,
-                    'segments': segments,
-                    'language': detected_language,
-                    'duration': max_end_time
-                }
-            else:
-                error_msg = response.json().get('error', {}).get('message', response.text)
-                print(f"  API 錯誤 ({response.status_code}): {error_msg}")
-                return {
-                    'success': False,
-                    'error': error_msg
-                }
-                
     except requests.exceptions.Timeout:
-        print("  錯誤：API 請求超時")
+        log("  錯誤：API 請求超時")
         return {'success': False, 'error': '請求超時'}
     except Exception as e:
-        print(f"  轉錄時發生錯誤: {e}")
+        log(f"  轉錄時發生錯誤: {e}")
         return {'success': False, 'error': str(e)}
 
 
 def split_audio(audio_path: Path, output_dir: Path, segment_duration: int = 600) -> list:
     """將大型音訊檔案分割成較小的片段（預設每段 10 分鐘）"""
     segments = []
+    # ffmpeg 會把檔名中的 % 當成編號格式，需寫成 %% 才是字面上的 %
+    segment_pattern = output_dir / f"{audio_path.stem.replace('%', '%%')}_segment_%03d.m4a"
     
-    # 先取得音訊總長度
+    # 使用 segment muxer 一次完成分割：來源只解碼、編碼一次，
+    # 不必為每個片段各跑一次 ffmpeg 並從頭 seek。
+    # 一律重新編碼為固定位元率，確保每個片段都低於 25MB（複製音軌會沿用來源的高位元率）
     cmd = [
-        'ffprobe',
-        '-v', 'error',
-        '-show_entries', 'format=duration',
-        '-of', 'default=noprint_wrappers=1:nokey=1',
-        str(audio_path)
+        'ffmpeg',
+        '-i', str(audio_path),
+        '-vn',
+        *AUDIO_ENCODE_ARGS,
+        '-f', 'segment',
+        '-segment_time', str(segment_duration),
+        '-reset_timestamps', '1',
+        '-y',
+        str(segment_pattern)
     ]
     
-    try:
-        result = subprocess.run(cmd, capture_output=True, text=True)
-        total_duration = float(result.stdout.strip())
-    except:
-        print("  無法取得音訊長度，使用預設分割")
-        total_duration = 3600  # 假設 1 小時
+    result = subprocess.run(cmd, capture_output=True, text=True, encoding='utf-8', errors='replace')
+    if result.returncode != 0:
+        log(f"  ffmpeg 分割錯誤: {result.stderr}")
     
-    # 計算需要幾個片段
-    num_segments = int(total_duration / segment_duration) + 1
-    
-    print(f"  音訊總長度: {total_duration:.1f} 秒，將分割為 {num_segments} 個片段")
-    
-    for i in range(num_segments):
-        start_time = i * segment_duration
-        segment_path = output_dir / f"{audio_path.stem}_segment_{i:03d}.m4a"
-        
-        cmd = [
-            'ffmpeg',
-            '-i', str(audio_path),
-            '-ss', str(start_time),
-            '-t', str(segment_duration),
-            '-acodec', 'aac',
-            '-b:a', '128k',
-            '-ar', '16000',
-            '-ac', '1',
-            '-y',
-            str(segment_path)
-        ]
-        
-        subprocess.run(cmd, capture_output=True)
-        
-        if segment_path.exists() and segment_path.stat().st_size > 0:
+    # 依編號排序，第 i 段的起始時間即為 i * segment_duration
+    # 檔名中的 [ ] * ? 是 glob 的特殊字元（例如 "lecture [1080p].mp4"），需先跳脫
+    segment_paths = sorted(output_dir.glob(f"{glob.escape(audio_path.stem)}_segment_*.m4a"))
+    for i, segment_path in enumerate(segment_paths):
+        if segment_path.stat().st_size > 0:
             segments.append({
                 'path': segment_path,
-                'start_time': start_time
+                'start_time': i * segment_duration
             })
     
+    log(f"  音訊已分割為 {len(segments)} 個片段")
+    
     return segments
 
 
 def transcribe_large_audio(audio_path: Path, api_key: str) -> dict:
     """處理超過 25MB 限制的大型音訊檔案"""
-    temp_dir = audio_path.parent / 'temp_segments'
+    # 每個檔案使用獨立的暫存目錄，避免並行處理時互相清除
+    temp_dir = audio_path.parent / f'{audio_path.stem}_segments'
     temp_dir.mkdir(exist_ok=True)
     
     try:
@@ -272,10 +422,14 @@ def transcribe_large_audio(audio_path: Path, api_key: str) -> dict:
         all_segments = []
         total_duration = 0
         
-        for i, segment_info in enumerate(segments):
-            print(f"  轉錄片段 {i + 1}/{len(segments)}...")
-            result = transcribe_audio_gpt4o(segment_info['path'], api_key)
-            
+        # 片段之間互相獨立，同時上傳轉錄（共用 SESSION 的連線池）
+        log(f"  同時轉錄 {len(segments)} 個片段...")
+        segments = sorted(segments, key=lambda s: s['start_time'])
+        with ThreadPoolExecutor(max_workers=max(1, min(len(segments), MAX_SEGMENT_WORKERS))) as executor:
+            results = list(executor.map(lambda s: transcribe_audio_gpt4o(s['path'], api_key), segments))
+        
+        # executor.map 保留輸入順序，依時間先後合併
+        for i, (segment_info, result) in enumerate(zip(segments, results)):
             if result['success']:
                 all_text.append(result['text'])
                 
@@ -287,7 +441,7 @@ def transcribe_large_audio(audio_path: Path, api_key: str) -> dict:
                 
                 total_duration += result.get('duration', 0)
             else:
-                print(f"  片段 {i + 1} 轉錄失敗: {result.get('error')}")
+                log(f"  片段 {i + 1} 轉錄失敗: {result.get('error')}")
         
         return {
             'success': True,
@@ -412,7 +566,69 @@ def save_detailed_transcript(result: dict, output_path: Path):
         f.write(result['text'])
 
 
+def _extract_worker(media_file: Path, temp_dir: Path) -> Path:
+    """取得可直接送給 OpenAI 的音訊檔：影片或不支援的格式以 ffmpeg 提取，否則直接沿用"""
+    print(f"\n準備音訊: {media_file.name}")
+    
+    ext = media_file.suffix.lower()
+    audio_path = None
+    
+    # 判斷是影片還是音訊
+    if ext in VIDEO_EXTENSIONS:
+        print("  偵測到影片檔案，提取音訊中...")
+        audio_path = extract_audio_from_video(media_file, temp_dir)
+    elif ext in AUDIO_EXTENSIONS:
+        print("  偵測到音訊檔案")
+        # 如果音訊格式不被 OpenAI 支援，轉換為 mp3
+        if ext not in OPENAI_SUPPORTED_FORMATS:
+            print(f"  格式 {ext} 不被 OpenAI 直接支援，轉換中...")
+            audio_path = extract_audio_from_video(media_file, temp_dir)
+        else:
+            audio_path = media_file
+    
+    return audio_path
+
+
+def process_one(media_file: Path, audio_path: Path, api_key: str, output_dir: Path) -> dict:
+    """轉錄單一媒體檔案的音訊並儲存詳細逐字稿，失敗時回傳 None"""
+    log(f"\n轉錄: {media_file.name}")
+    
+    # 轉錄
+    transcript_result = transcribe_audio_gpt4o(audio_path, api_key)
+    
+    if not transcript_result['success']:
+        log(f"  轉錄失敗 ({media_file.name}): {transcript_result.get('error')}")
+        return None
+    
+    result = {
+        'filename': media_file.name,
+        'text': transcript_result['text'],
+        'segments': transcript_result.get('segments', []),
+        'language': transcript_result.get('language', 'zh'),
+        'duration': transcript_result.get('duration', 0),
+        'processed_at': datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    }
+    
+    # 儲存個別詳細逐字稿
+    detail_path = output_dir / f"{media_file.stem}_transcript.md"
+    save_detailed_transcript(result, detail_path)
+    log(f"  轉錄成功! 詳細逐字稿已儲存至: {detail_path.name}")
+    
+    return result
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='使用 GPT-4o-transcribe-diarize 將 input/ 內的影片或音訊轉為逐字稿')
+    parser.add_argument('--max-workers', type=int, default=DEFAULT_MAX_WORKERS,
+                        help=f'同時處理的檔案數（預設 {DEFAULT_MAX_WORKERS}，受 OpenAI 速率限制影響）')
+    parser.add_argument('--extract-workers', type=int, default=os.cpu_count() or 1,
+                        help='同時執行 ffmpeg 提取音訊的行程數（預設為 CPU 核心數）')
+    return parser.parse_args()
+
+
 def main():
+    args = parse_args()
+    
     # 取得腳本所在目錄，使用上層目錄的共用 input/output 資料夾
     script_dir = Path(__file__).parent
     root_dir = script_dir.parent  # 上層目錄 (new/)
@@ -448,49 +664,39 @@ def main():
     
     results = []
     
-    for media_file in media_files:
-        print(f"\n處理: {media_file.name}")
-        
-        ext = media_file.suffix.lower()
-        audio_path = None
-        
-        # 判斷是影片還是音訊
-        if ext in VIDEO_EXTENSIONS:
-            print("  偵測到影片檔案，提取音訊中...")
-            audio_path = extract_audio_from_video(media_file, temp_dir)
-        elif ext in AUDIO_EXTENSIONS:
-            print("  偵測到音訊檔案")
-            # 如果音訊格式不被 OpenAI 支援，轉換為 mp3
-            if ext not in OPENAI_SUPPORTED_FORMATS:
-                print(f"  格式 {ext} 不被 OpenAI 直接支援，轉換中...")
-                audio_path = extract_audio_from_video(media_file, temp_dir)
-            else:
-                audio_path = media_file
-        
+    # 階段 1：ffmpeg 提取音訊屬 CPU 密集工作，各檔案互相獨立，以多行程並行
+    extract_workers = max(1, min(args.extract_workers, len(media_files)))
+    with ProcessPoolExecutor(max_workers=extract_workers) as executor:
+        audio_paths = list(executor.map(_extract_worker, media_files, repeat(temp_dir)))
+    
+    pending = []
+    for media_file, audio_path in zip(media_files, audio_paths):
         if audio_path is None:
             print(f"  無法處理檔案: {media_file.name}")
-            continue
-        
-        # 轉錄
-        transcript_result = transcribe_audio_gpt4o(audio_path, api_key)
-        
-        if transcript_result['success']:
-            result = {
-                'filename': media_file.name,
-                'text': transcript_result['text'],
-                'segments': transcript_result.get('segments', []),
-                'language': transcript_result.get('language', 'zh'),
-                'duration': transcript_result.get('duration', 0),
-                'processed_at': datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-            }
-            results.append(result)
-            
-            # 儲存個別詳細逐字稿
-            detail_path = output_dir / f"{media_file.stem}_transcript.md"
-            save_detailed_transcript(result, detail_path)
-            print(f"  轉錄成功! 詳細逐字稿已儲存至: {detail_path.name}")
         else:
-            print(f"  轉錄失敗: {transcript_result.get('error')}")
+            pending.append((media_file, audio_path))
+    
+    # 階段 2：API 呼叫以網路等待為主，以執行緒池並行
+    max_workers = max(1, min(args.max_workers, len(pending) or 1))
+    configure_session(max_workers)
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {
+            executor.submit(process_one, media_file, audio_path, api_key, output_dir): media_file
+            for media_file, audio_path in pending
+        }
+        for future in as_completed(futures):
+            media_file = futures[future]
+            try:
+                result = future.result()
+            except Exception as e:
+                log(f"  處理 {media_file.name} 時發生錯誤: {e}")
+                continue
+            if result is not None:
+                results.append(result)
+    
+    # 依原始檔案順序輸出，結果不受完成先後影響
+    order = {f.name: i for i, f in enumerate(media_files)}
+    results.sort(key=lambda r: order[r['filename']])
     
     # 儲存彙整的 CSV
     if results:
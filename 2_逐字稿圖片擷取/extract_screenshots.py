@@ -1,28 +1,192 @@
 import cv2
 import csv
+import functools
 import os
+import shutil
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
 
+# Optional: libjpeg-turbo encodes JPEGs 2-4x faster than cv2.imwrite
+try:
+    from turbojpeg import TurboJPEG
+except ImportError:
+    TurboJPEG = None
+
+# Gap (ms) beyond which seeking is cheaper than decoding forward frame by frame
+SEEK_THRESHOLD_MSEC = 10000
+# Quality for the TurboJPEG encode path only
+JPEG_QUALITY = 85
+
+# Lazily created TurboJPEG instance (False when the library is unavailable)
+_jpeg_encoder = None
+
+def get_jpeg_encoder():
+    global _jpeg_encoder
+    if _jpeg_encoder is None:
+        _jpeg_encoder = False
+        if TurboJPEG is not None:
+            try:
+                _jpeg_encoder = TurboJPEG()
+            except Exception as e:
+                print(f"警告：無法載入 libturbojpeg，改用 OpenCV 編碼 JPEG：{e}")
+    return _jpeg_encoder
+
+def save_jpeg(filepath, frame):
+    """Encodes a BGR frame to JPEG, using TurboJPEG when available."""
+    encoder = get_jpeg_encoder()
+    if encoder:
+        with open(filepath, 'wb') as f:
+            f.write(encoder.encode(frame, quality=JPEG_QUALITY))
+    else:
+        # Fallback keeps OpenCV's default quality (95), as before TurboJPEG was added
+        cv2.imwrite(filepath, frame)
+
+def link_or_copy(src, dst):
+    """Hard-links dst to src, copying instead where hard links are unsupported."""
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copyfile(src, dst)
+
+def open_video(video_path):
+    """Opens a video, requesting hardware-accelerated decoding when OpenCV supports it."""
+    if hasattr(cv2, 'VIDEO_ACCELERATION_ANY'):
+        cap = cv2.VideoCapture(video_path, cv2.CAP_FFMPEG,
+                               [cv2.CAP_PROP_HW_ACCELERATION, cv2.VIDEO_ACCELERATION_ANY])
+        if cap.isOpened():
+            return cap
+    return cv2.VideoCapture(video_path)
+
+@functools.lru_cache(maxsize=4096)
 def time_to_msec(time_str):
     """Converts a time string MM:SS or HH:MM:SS to milliseconds."""
-    try:
-        if ':' not in time_str:
-            return 0
-        
-        parts = time_str.split(':')
-        
-        if len(parts) == 2:
-            # MM:SS format
-            m, s = parts
-            return int((int(m) * 60 + float(s)) * 1000)
-        elif len(parts) == 3:
-            # HH:MM:SS format
-            h, m, s = parts
-            return int((int(h) * 3600 + int(m) * 60 + float(s)) * 1000)
-        else:
-            return 0
-    except ValueError:
+    # Integer-only parse; boundaries repeat (end of one row == start of the next), hence the cache
+    colons = time_str.count(':')
+    if colons == 1:
+        h = '0'
+        m, s = time_str.split(':')
+    elif colons == 2:
+        h, m, s = time_str.split(':')
+    else:
         return 0
 
+    whole, _, frac = s.strip().partition('.')
+    whole = whole or '0'
+    frac = (frac + '00')[:3]  # fractional seconds -> milliseconds
+    h = h.strip()
+    m = m.strip()
+    if not (h.isdecimal() and m.isdecimal() and whole.isdecimal() and frac.isdecimal()):
+        return 0
+
+    return (int(h) * 3600 + int(m) * 60 + int(whole)) * 1000 + int(frac)
+
+def capture_frames(cap, targets, screenshots_folder):
+    """Saves one frame per target while decoding the video forward once.
+
+    targets is a list of (msec, filenames, time_str) sorted by msec, one entry per
+    unique timestamp. Each captured frame is encoded once and hard-linked to the
+    other filenames that need it. Returns the set of filenames that were written.
+    """
+    saved = set()
+    current_msec = -1.0
+    last_seek = None
+    t = 0
+
+    while t < len(targets):
+        target_msec = targets[t][0]
+
+        # Jump over long gaps with a single seek instead of decoding every frame in between
+        if target_msec - current_msec > SEEK_THRESHOLD_MSEC and target_msec != last_seek:
+            cap.set(cv2.CAP_PROP_POS_MSEC, target_msec)
+            last_seek = target_msec
+
+        if not cap.grab():
+            break
+        current_msec = cap.get(cv2.CAP_PROP_POS_MSEC)
+        if current_msec < target_msec:
+            continue
+
+        # Decode the grabbed frame only when a target has been reached
+        ret, frame = cap.retrieve()
+        frame_path = None
+        while t < len(targets) and targets[t][0] <= current_msec:
+            _, filenames, time_str = targets[t]
+            t += 1
+            if not ret:
+                print(f"警告：無法擷取 {time_str} 時間點的畫面")
+                continue
+            for filename in filenames:
+                filepath = os.path.join(screenshots_folder, filename)
+                # Never write through a hard link left by a previous run
+                if os.path.exists(filepath):
+                    os.remove(filepath)
+                if frame_path is None:
+                    save_jpeg(filepath, frame)
+                    frame_path = filepath
+                else:
+                    link_or_copy(frame_path, filepath)
+                saved.add(filename)
+
+    # Targets past the end of the video
+    for _, _, time_str in targets[t:]:
+        print(f"警告：無法擷取 {time_str} 時間點的畫面")
+
+    return saved
+
+def _extract_for_video(video_name, group, input_folder, screenshots_folder):
+    """Captures start/end frames for every row of one video.
+
+    Returns a list of (row index, row with the two image filename columns appended).
+    """
+    video_path = os.path.join(input_folder, video_name)
+
+    # Check if video exists
+    if not os.path.exists(video_path):
+        print(f"警告：找不到影片檔案 '{video_path}'，跳過此影片")
+        return [(i, row + ['', '']) for i, row in group]
+
+    # Open video
+    cap = open_video(video_path)
+    if not cap.isOpened():
+        print(f"錯誤：無法開啟影片 '{video_path}'")
+        return [(i, row + ['', '']) for i, row in group]
+
+    print(f"處理影片：{video_name}，共 {len(group)} 段")
+
+    # Each unique timestamp is decoded once; adjacent rows usually share a boundary
+    unique_ms = defaultdict(list)  # msec -> filenames
+    time_strs = {}
+    for i, row in group:
+        for kind, time_str in (('start', row[1]), ('end', row[2])):
+            msec = time_to_msec(time_str)
+            unique_ms[msec].append(f"img_{i+1}_{kind}.jpg")
+            time_strs.setdefault(msec, time_str)
+
+    # Visit the timestamps in time order so the video is decoded sequentially
+    targets = sorted(
+        ((msec, filenames, time_strs[msec]) for msec, filenames in unique_ms.items()),
+        key=lambda x: x[0]
+    )
+
+    try:
+        saved = capture_frames(cap, targets, screenshots_folder)
+    finally:
+        cap.release()
+
+    updated_rows = []
+    for i, row in group:
+        start_filename = f"img_{i+1}_start.jpg"
+        end_filename = f"img_{i+1}_end.jpg"
+
+        # Append new columns
+        new_row = row + [
+            start_filename if start_filename in saved else '',
+            end_filename if end_filename in saved else ''
+        ]
+        updated_rows.append((i, new_row))
+
+    return updated_rows
+
 def extract_frames():
     # 取得腳本所在目錄，使用上層目錄的共用 input/output 資料夾
     script_dir = os.path.dirname(os.path.abspath(__file__))
@@ -46,101 +210,39 @@ def extract_frames():
     if not os.path.exists(screenshots_folder):
         os.makedirs(screenshots_folder)
 
-    # Read CSV
-    rows = []
+    # Stream the CSV straight into per-video groups (utf-8-sig also accepts files without a BOM)
     header = []
+    video_groups = defaultdict(list)
     try:
-        with open(csv_input_path, 'r', encoding='utf-8') as f:
-            reader = csv.reader(f)
-            header = next(reader)  # Read header
-            rows = list(reader)
-    except UnicodeDecodeError:
         with open(csv_input_path, 'r', encoding='utf-8-sig') as f:
             reader = csv.reader(f)
-            header = next(reader)
-            rows = list(reader)
+            header = next(reader, [])  # Read header
+            for i, row in enumerate(reader):
+                if len(row) >= 5:
+                    video_groups[row[0]].append((i, row))
     except Exception as e:
         print(f"讀取 CSV 錯誤：{e}")
         return
 
-    if not rows:
+    if not video_groups:
         print("CSV 檔案中沒有資料")
         return
 
-    # Group rows by video file
-    video_groups = {}
-    for i, row in enumerate(rows):
-        if len(row) < 5:
-            continue
-        video_name = row[0]
-        if video_name not in video_groups:
-            video_groups[video_name] = []
-        video_groups[video_name].append((i, row))
-
-    updated_rows = []
-    
-    for video_name, group in video_groups.items():
-        video_path = os.path.join(input_folder, video_name)
-        
-        # Check if video exists
-        if not os.path.exists(video_path):
-            print(f"警告：找不到影片檔案 '{video_path}'，跳過此影片")
-            for i, row in group:
-                new_row = row + ['', '']
-                updated_rows.append((i, new_row))
-            continue
-
-        # Open video
-        cap = cv2.VideoCapture(video_path)
-        if not cap.isOpened():
-            print(f"錯誤：無法開啟影片 '{video_path}'")
-            for i, row in group:
-                new_row = row + ['', '']
-                updated_rows.append((i, new_row))
-            continue
-
-        print(f"處理影片：{video_name}，共 {len(group)} 段")
-
-        for idx, (i, row) in enumerate(group):
-            start_time_str = row[1]
-            end_time_str = row[2]
-
-            start_msec = time_to_msec(start_time_str)
-            end_msec = time_to_msec(end_time_str)
-
-            # Define filenames
-            start_filename = f"img_{i+1}_start.jpg"
-            end_filename = f"img_{i+1}_end.jpg"
-            start_filepath = os.path.join(screenshots_folder, start_filename)
-            end_filepath = os.path.join(screenshots_folder, end_filename)
-
-            # Capture Start Frame
-            cap.set(cv2.CAP_PROP_POS_MSEC, start_msec)
-            ret, frame = cap.read()
-            if ret:
-                cv2.imwrite(start_filepath, frame)
-            else:
-                print(f"警告：無法擷取 {start_time_str} 時間點的畫面")
-                start_filename = ''
-
-            # Capture End Frame
-            cap.set(cv2.CAP_PROP_POS_MSEC, end_msec)
-            ret, frame = cap.read()
-            if ret:
-                cv2.imwrite(end_filepath, frame)
-            else:
-                print(f"警告：無法擷取 {end_time_str} 時間點的畫面")
-                end_filename = ''
-
-            # Append new columns
-            new_row = row + [start_filename, end_filename]
-            updated_rows.append((i, new_row))
-
-        cap.release()
-
-    # Sort by original index
-    updated_rows.sort(key=lambda x: x[0])
-    updated_rows = [row for _, row in updated_rows]
+    # Videos are independent, so decode them in parallel processes; a single
+    # video runs inline to avoid the process start-up cost
+    updated_rows = {}
+    workers = min(os.cpu_count() or 1, len(video_groups))
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = [
+                executor.submit(_extract_for_video, video_name, group, input_folder, screenshots_folder)
+                for video_name, group in video_groups.items()
+            ]
+            for future in futures:
+                updated_rows.update(future.result())
+    else:
+        for video_name, group in video_groups.items():
+            updated_rows.update(_extract_for_video(video_name, group, input_folder, screenshots_folder))
 
     # Define new header
     new_header = header + ['開始照片檔名', '結束照片檔名']
@@ -150,7 +252,9 @@ def extract_frames():
         with open(csv_output_path, 'w', newline='', encoding='utf-8') as f:
             writer = csv.writer(f)
             writer.writerow(new_header)
-            writer.writerows(updated_rows)
+            # Write rows one at a time in original order
+            for i in sorted(updated_rows):
+                writer.writerow(updated_rows[i])
         print(f"成功輸出 CSV 至 {csv_output_path}")
         print(f"成功儲存截圖至 {screenshots_folder} 資料夾")
     except Exception as e:
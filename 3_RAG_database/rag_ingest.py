@@ -1,15 +1,27 @@
 import os
 import sys
+import argparse
+import hashlib
+import operator
+import pickle
+import queue
+import threading
 import sqlite3
 import csv
 import numpy as np
 import faiss
 import torch
+import torch.nn.functional as F
 from PIL import Image
 from transformers import CLIPProcessor, CLIPModel
 
+from rag_query import index_file_digest
+
 # --- Configuration ---
 CLIP_MODEL_NAME = "openai/clip-vit-base-patch32"
+# Texts per CLIP forward pass (GPUs need larger batches to stay busy)
+DEFAULT_BATCH_SIZE = 32
+DEFAULT_GPU_BATCH_SIZE = 256
 
 # 取得腳本所在目錄，使用上層目錄的共用 input/output 資料夾
 SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
@@ -23,25 +35,69 @@ SCREENSHOTS_DIR = os.path.join(OUTPUT_DIR, 'screenshots')
 # RAG 資料庫也輸出到 output
 DB_PATH = os.path.join(OUTPUT_DIR, 'rag_mm.db')
 INDEX_PATH = os.path.join(OUTPUT_DIR, 'transcript.index')
+# 搜尋結果所需欄位的 {faiss_id: dict} 快照，rag_query 載入記憶體後查詢時不必經過 SQLite
+METADATA_PATH = os.path.join(OUTPUT_DIR, 'metadata.pkl')
+# 寫入 metadata.pkl 的欄位（對應 METADATA_COLUMNS 的前五欄）
+RESULT_FIELDS = ('video_file', 'start_time', 'end_time', 'speaker', 'content')
+# HNSW 索引參數：M 為每個節點的連結數，efConstruction/efSearch 控制建置與搜尋時的候選數
+HNSW_M = 32
+HNSW_EF_CONSTRUCTION = 200
+HNSW_EF_SEARCH = 64
+# 大型語料改用 IVF-PQ：向量壓縮為 32 bytes 的 PQ 碼，搜尋只掃描 nprobe 個分群
+IVF_PQ_FACTORY = "IVF4096,PQ32x8"
+IVF_NPROBE = 16
+# FAISS 建議每個分群至少 39 筆訓練資料，語料少於此數時維持 HNSW
+IVF_PQ_MIN_VECTORS = 39 * 4096
+# transcripts.csv 欄位，依序對應 transcripts 資料表的
+# video_file, start_time, end_time, speaker, content, language, process_time, start_image, end_image
+METADATA_COLUMNS = ('檔案名稱', '開始時間', '結束時間', '講者', '內容', '偵測語言', '處理時間', '開始照片檔名', '結束照片檔名')
+CONTENT_FIELD = METADATA_COLUMNS.index('內容')
+START_IMAGE_FIELD = METADATA_COLUMNS.index('開始照片檔名')
+END_IMAGE_FIELD = METADATA_COLUMNS.index('結束照片檔名')
+# 截圖由 server.py 的 /api/image/<filename> 提供，URL 在建立索引時即寫入資料庫
+IMAGE_URL_PREFIX = '/api/image/'
+# CSV 讀取端最多預先排隊的批次數
+PIPELINE_QUEUE_SIZE = 4
+# 每次查詢向量快取並送進 CLIP 的文字數 = batch_size * EMBED_WINDOW_BATCHES：
+# 視窗夠大，依長度排序才有意義，快取命中後剩下的文字也能湊成完整批次
+EMBED_WINDOW_BATCHES = 16
+# 向量快取：文字雜湊 -> CLIP 向量，重新 ingest 時只需計算新的文字
+EMB_CACHE_PATH = os.path.join(OUTPUT_DIR, 'emb_cache.sqlite')
+# SQLite 單一查詢可綁定的參數數量有限，分段查詢
+CACHE_LOOKUP_CHUNK = 500
 
 # --- Globals for Models (Lazy loading) ---
 clip_model = None
 clip_processor = None
+device = 'cuda' if torch.cuda.is_available() else 'cpu'
 
 def load_models():
     global clip_model, clip_processor
     if clip_model is None:
-        print("Loading CLIP model...")
-        clip_model = CLIPModel.from_pretrained(CLIP_MODEL_NAME)
+        print(f"Loading CLIP model on {device}...")
+        clip_model = CLIPModel.from_pretrained(CLIP_MODEL_NAME).to(device).eval()
         clip_processor = CLIPProcessor.from_pretrained(CLIP_MODEL_NAME)
+        if device == 'cuda':
+            # FP16 halves memory traffic and runs on tensor cores
+            clip_model = clip_model.half()
+            # torch.compile relies on Triton, which is unavailable on Windows.
+            # Batches are padded to varying lengths, so compile with dynamic shapes
+            if hasattr(torch, 'compile') and sys.platform != 'win32':
+                clip_model.text_model = torch.compile(clip_model.text_model, dynamic=True)
 
 def get_db_connection():
     conn = sqlite3.connect(DB_PATH)
     conn.row_factory = sqlite3.Row
+    # WAL + NORMAL sync: one fsync per checkpoint instead of per transaction
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('PRAGMA synchronous=NORMAL')
+    conn.execute('PRAGMA temp_store=MEMORY')
+    # Wait for a concurrent reader/writer (e.g. the search server) instead of failing with "database is locked"
+    conn.execute('PRAGMA busy_timeout=5000')
     return conn
 
-def init_db(drop=False):
-    conn = get_db_connection()
+def create_schema(conn, drop=False):
+    """建立 transcripts 資料表與索引（不提交，可在交易中呼叫）"""
     if drop:
         conn.execute('DROP TABLE IF EXISTS transcripts')
     conn.execute('''
@@ -56,38 +112,216 @@ def init_db(drop=False):
             language TEXT,
             process_time TEXT,
             start_image TEXT,
-            end_image TEXT
+            end_image TEXT,
+            start_image_url TEXT,
+            end_image_url TEXT
         )
     ''')
+    # rag_query.py 以 faiss_id 回查逐字稿
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_faiss_id ON transcripts(faiss_id)')
+
+def init_db(drop=False):
+    conn = get_db_connection()
+    create_schema(conn, drop)
     conn.commit()
     conn.close()
 
 def get_text_embedding(text):
     """取得單一文字的向量嵌入"""
     load_models()
-    inputs = clip_processor(text=[text], return_tensors="pt", padding=True, truncation=True)
-    with torch.no_grad():
+    inputs = clip_processor(text=[text], return_tensors="pt", padding='longest', truncation=True)
+    inputs = {k: v.to(device) for k, v in inputs.items()}
+    with torch.inference_mode():
         outputs = clip_model.get_text_features(**inputs)
-        embedding = outputs / outputs.norm(p=2, dim=-1, keepdim=True)
-        return embedding.numpy()
+        embedding = F.normalize(outputs, p=2, dim=-1)
+        return embedding.float().cpu().numpy()
 
-def get_batch_embeddings(texts):
+def get_batch_embeddings(texts, batch_size=None):
     """批次取得文字的向量嵌入"""
+    if not texts:
+        return None
     load_models()
-    embeddings = []
-    batch_size = 32
+    if batch_size is None:
+        batch_size = DEFAULT_GPU_BATCH_SIZE if device == 'cuda' else DEFAULT_BATCH_SIZE
+    
+    # Sort by length so every batch pads to roughly the same token count
+    order = np.argsort([len(t) for t in texts], kind='stable')
+    embeddings = np.empty((len(texts), clip_model.config.projection_dim), dtype=np.float32)
     
     for i in range(0, len(texts), batch_size):
-        batch = texts[i:i+batch_size]
-        inputs = clip_processor(text=batch, return_tensors="pt", padding=True, truncation=True)
-        with torch.no_grad():
+        batch_idx = order[i:i+batch_size]
+        batch = [texts[j] for j in batch_idx]
+        inputs = clip_processor(text=batch, return_tensors="pt", padding='longest', truncation=True)
+        inputs = {k: v.to(device) for k, v in inputs.items()}
+        with torch.inference_mode():
             outputs = clip_model.get_text_features(**inputs)
-            batch_emb = outputs / outputs.norm(p=2, dim=-1, keepdim=True)
-            embeddings.append(batch_emb.numpy())
+            batch_emb = F.normalize(outputs, p=2, dim=-1)
+            # Scatter straight back to the original positions, no vstack/un-sort copy
+            embeddings[batch_idx] = batch_emb.float().cpu().numpy()
+    
+    return embeddings
+
+def open_embedding_cache():
+    """開啟向量快取資料庫（整個 ingest 共用一條連線）"""
+    conn = sqlite3.connect(EMB_CACHE_PATH)
+    # 向量以 float16 儲存（CLIP 512 維單位向量的精度損失可忽略），舊版 float32 快取表直接捨棄
+    conn.execute('DROP TABLE IF EXISTS embeddings')
+    conn.execute('CREATE TABLE IF NOT EXISTS embeddings_fp16 (hash BLOB PRIMARY KEY, vec BLOB)')
+    conn.commit()
+    return conn
+
+def get_cached_embeddings(conn, texts, batch_size=None):
+    """從向量快取（open_embedding_cache 開啟的連線）取得嵌入，只對未命中的文字執行 CLIP"""
+    if not texts:
+        return None
     
-    return np.vstack(embeddings) if embeddings else None
+    # 快取鍵包含模型名稱，更換模型時自動失效
+    keys = [hashlib.sha1(f"{CLIP_MODEL_NAME}\0{t}".encode('utf-8')).digest() for t in texts]
+    unique = dict(zip(keys, texts))
+    
+    vectors = {}
+    unique_keys = list(unique)
+    for i in range(0, len(unique_keys), CACHE_LOOKUP_CHUNK):
+        chunk = unique_keys[i:i+CACHE_LOOKUP_CHUNK]
+        placeholders = ','.join('?' * len(chunk))
+        for key, vec in conn.execute(f'SELECT hash, vec FROM embeddings_fp16 WHERE hash IN ({placeholders})', chunk):
+            vectors[key] = np.frombuffer(vec, dtype=np.float16)
+    
+    miss_keys = [k for k in unique_keys if k not in vectors]
+    print(f"Embedding cache: {len(vectors)} hits, {len(miss_keys)} misses.")
+    
+    if miss_keys:
+        # 新算出的向量同樣轉為 float16，快取命中與否得到的結果一致
+        new_embeddings = get_batch_embeddings([unique[k] for k in miss_keys], batch_size).astype(np.float16)
+        with conn:
+            conn.executemany(
+                'INSERT OR REPLACE INTO embeddings_fp16 (hash, vec) VALUES (?, ?)',
+                [(k, v.tobytes()) for k, v in zip(miss_keys, new_embeddings)]
+            )
+        vectors.update(zip(miss_keys, new_embeddings))
+    
+    return np.stack([vectors[k] for k in keys]).astype(np.float32, copy=False)
+
+# Sentinel telling the consumer to roll back instead of committing
+_ABORT = object()
+
+def _read_transcript_batches(batch_size, q_in, errors, stop):
+    """Producer: streams non-empty CSV records onto q_in in batches, then a None sentinel.
 
-def ingest():
+    Each record is a tuple of the METADATA_COLUMNS values, looked up by position.
+    Stops early once `stop` is set; the caller drains q_in so the final put never blocks.
+    """
+    try:
+        with open(TRANSCRIPTS_FILE, 'r', encoding='utf-8-sig') as f:
+            reader = csv.reader(f)
+            header = next(reader, [])
+            
+            # Resolve column positions once; absent columns (e.g. no screenshots yet)
+            # point one past the header, where short rows are padded with ''
+            idx = {name: i for i, name in enumerate(header)}
+            cols = [idx.get(name, len(header)) for name in METADATA_COLUMNS]
+            get_record = operator.itemgetter(*cols)
+            width = max(cols) + 1
+            padding = [''] * width
+            
+            batch = []
+            for row in reader:
+                record = get_record(row if len(row) >= width else row + padding[len(row):])
+                # Skip empty rows
+                if not record[CONTENT_FIELD].strip():
+                    continue
+                batch.append(record)
+                if len(batch) == batch_size:
+                    if stop.is_set():
+                        return
+                    q_in.put(batch)
+                    batch = []
+            if batch and not stop.is_set():
+                q_in.put(batch)
+    except Exception as e:
+        errors.append(e)
+    finally:
+        q_in.put(None)
+
+def _scan_screenshots():
+    """列出截圖資料夾中的檔名（os.scandir 不需逐檔 stat）"""
+    try:
+        with os.scandir(SCREENSHOTS_DIR) as entries:
+            return frozenset(entry.name for entry in entries)
+    except FileNotFoundError:
+        return frozenset()
+
+def _index_and_store(q_out, result, errors):
+    """Consumer: adds embeddings to the FAISS index and inserts metadata in one transaction."""
+    index = None
+    metadata = {}
+    screenshots = _scan_screenshots()
+    
+    def image_url(filename):
+        # 截圖不存在時存 NULL，查詢端直接沿用
+        return IMAGE_URL_PREFIX + filename if filename in screenshots else None
+    
+    conn = get_db_connection()
+    try:
+        # IMMEDIATE takes the write lock up front, so the batched inserts never hit a
+        # lock upgrade conflict halfway through
+        conn.execute('BEGIN IMMEDIATE')
+        # 重建資料表也在同一交易內：中途失敗回滾時，舊資料表仍與舊索引一致
+        create_schema(conn, drop=True)
+        while True:
+            item = q_out.get()
+            if item is None:
+                break
+            if item is _ABORT:
+                conn.rollback()
+                return
+            
+            records, embeddings = item
+            if index is None:
+                # 向量已做 L2 正規化，內積即為 cosine 相似度；HNSW 搜尋為近似 O(log N)，不必暴力掃描。
+                # 節點向量以 float16 純量量化儲存（記憶體與索引檔減半），查詢向量維持 float32
+                index = faiss.IndexHNSWSQ(embeddings.shape[1], faiss.ScalarQuantizer.QT_fp16, HNSW_M,
+                                          faiss.METRIC_INNER_PRODUCT)
+                index.hnsw.efConstruction = HNSW_EF_CONSTRUCTION
+            
+            # faiss_id follows insertion order into the index
+            base = index.ntotal
+            index.add(embeddings)
+            rows = []
+            for i, record in enumerate(records):
+                start_url = image_url(record[START_IMAGE_FIELD])
+                end_url = image_url(record[END_IMAGE_FIELD])
+                rows.append((base + i, *record, start_url, end_url))
+                metadata[base + i] = dict(zip(RESULT_FIELDS, record), start_image_url=start_url, end_image_url=end_url)
+            conn.executemany('''
+                INSERT INTO transcripts 
+                (faiss_id, video_file, start_time, end_time, speaker, content, language, process_time, start_image, end_image,
+                 start_image_url, end_image_url)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ''', rows)
+        
+        # All rows in a single transaction: one journal flush instead of one per row
+        conn.commit()
+        result['index'] = index
+        result['metadata'] = metadata
+    except Exception as e:
+        conn.rollback()
+        errors.append(e)
+    finally:
+        conn.close()
+
+def build_ivf_pq_index(hnsw_index):
+    """以 HNSW 索引中的向量訓練並建立 IVF-PQ 索引（faiss_id 順序不變）"""
+    print(f"Building {IVF_PQ_FACTORY} index for {hnsw_index.ntotal} vectors...")
+    embeddings = hnsw_index.reconstruct_n(0, hnsw_index.ntotal)
+    index = faiss.index_factory(hnsw_index.d, IVF_PQ_FACTORY, faiss.METRIC_INNER_PRODUCT)
+    index.train(embeddings)
+    index.add(embeddings)
+    # nprobe 同樣會隨索引檔一起儲存
+    faiss.extract_index_ivf(index).nprobe = IVF_NPROBE
+    return index
+
+def ingest(batch_size=None):
     """從 transcripts.csv 建立向量索引"""
     # Ensure output directory exists
     os.makedirs(OUTPUT_DIR, exist_ok=True)
@@ -97,81 +331,95 @@ def ingest():
         print(f"Error: {TRANSCRIPTS_FILE} not found.")
         sys.exit(1)
     
-    # Initialize/Reset DB
-    init_db(drop=True)
+    if batch_size is None:
+        batch_size = DEFAULT_GPU_BATCH_SIZE if device == 'cuda' else DEFAULT_BATCH_SIZE
     
-    conn = get_db_connection()
-    cursor = conn.cursor()
+    # Three-stage pipeline: CSV reader thread -> CLIP (this thread) -> FAISS/SQLite writer thread,
+    # so reading and storing overlap with the embedding forward passes
+    q_in = queue.Queue(maxsize=PIPELINE_QUEUE_SIZE)
+    q_out = queue.Queue()
+    errors = []
+    result = {}
+    # 讀取端以「視窗」為單位排隊，CLIP 端在視窗內依長度排序、切成 batch_size 的批次
+    window_size = batch_size * EMBED_WINDOW_BATCHES
+    stop = threading.Event()
+    producer = threading.Thread(target=_read_transcript_batches, args=(window_size, q_in, errors, stop), daemon=True)
+    consumer = threading.Thread(target=_index_and_store, args=(q_out, result, errors), daemon=True)
+    producer.start()
+    consumer.start()
     
-    # Read transcripts CSV
-    transcripts = []
-    with open(TRANSCRIPTS_FILE, 'r', encoding='utf-8') as f:
-        reader = csv.DictReader(f)
-        for row in reader:
-            # Skip empty rows
-            if not row.get('內容', '').strip():
-                continue
-            transcripts.append(row)
+    print("Generating embeddings...")
+    done = _ABORT
+    cache_conn = open_embedding_cache()
+    try:
+        # 任一端出錯後就不再編碼剩下的資料
+        while not errors:
+            records = q_in.get()
+            if records is None:
+                break
+            embeddings = get_cached_embeddings(cache_conn, [r[CONTENT_FIELD] for r in records], batch_size)
+            q_out.put((records, embeddings))
+        # 讀取端出錯時同樣會送出 None，此時不可提交只讀到一半的資料
+        if not errors:
+            done = None
+    finally:
+        cache_conn.close()
+        # 通知讀取端停止並清空佇列，讓卡在 put 上的讀取端能結束、關閉 CSV
+        stop.set()
+        while producer.is_alive():
+            try:
+                q_in.get(timeout=0.1)
+            except queue.Empty:
+                pass
+        producer.join()
+        q_out.put(done)
+        consumer.join()
     
-    print(f"Found {len(transcripts)} transcript entries.")
+    if errors:
+        raise errors[0]
     
-    if not transcripts:
+    index = result.get('index')
+    if index is None or index.ntotal == 0:
         print("No transcripts found.")
         return
     
-    # Extract content for embedding
-    contents = [t['內容'] for t in transcripts]
+    print(f"Embedded {index.ntotal} transcript entries.")
     
-    # Get embeddings
-    print("Generating embeddings...")
-    embeddings = get_batch_embeddings(contents)
-    
-    if embeddings is None or len(embeddings) == 0:
-        print("Failed to generate embeddings.")
-        return
-    
-    # Build FAISS index
-    d = embeddings.shape[1]
-    index = faiss.IndexFlatIP(d)
-    index.add(embeddings)
+    if index.ntotal >= IVF_PQ_MIN_VECTORS:
+        index = build_ivf_pq_index(index)
+    else:
+        # efSearch 會隨索引檔一起儲存，rag_query.py 讀取後即沿用此設定（此處是唯一的設定來源）
+        index.hnsw.efSearch = HNSW_EF_SEARCH
     
     # 解決 FAISS 在 Windows 上寫入中文路徑的問題
     original_cwd = os.getcwd()
     index_dir = os.path.dirname(INDEX_PATH)
-    index_filename = os.path.basename(INDEX_PATH)
+    tmp_index_path = INDEX_PATH + '.tmp'
     
     try:
         os.chdir(index_dir)
-        faiss.write_index(index, index_filename)
+        # 先寫入暫存檔再原子替換：rag_query 以 mmap 讀取的舊索引不會被就地覆寫
+        faiss.write_index(index, os.path.basename(tmp_index_path))
     finally:
         os.chdir(original_cwd)
+    
+    # metadata.pkl 記錄這一版索引的內容雜湊，rag_query 只在兩者相符時使用它；
+    # 中繼資料先於索引替換：rag_query 偵測到索引檔更新時，對應的 metadata.pkl 已就緒
+    tmp_metadata_path = METADATA_PATH + '.tmp'
+    with open(tmp_metadata_path, 'wb') as f:
+        pickle.dump({'index_digest': index_file_digest(tmp_index_path), 'rows': result['metadata']},
+                    f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_metadata_path, METADATA_PATH)
+    os.replace(tmp_index_path, INDEX_PATH)
         
     print(f"FAISS index saved to {INDEX_PATH}")
-    
-    # Insert metadata into database
-    for i, t in enumerate(transcripts):
-        cursor.execute('''
-            INSERT INTO transcripts 
-            (faiss_id, video_file, start_time, end_time, speaker, content, language, process_time, start_image, end_image)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-        ''', (
-            i,
-            t.get('檔案名稱', ''),
-            t.get('開始時間', ''),
-            t.get('結束時間', ''),
-            t.get('講者', ''),
-            t.get('內容', ''),
-            t.get('偵測語言', ''),
-            t.get('處理時間', ''),
-            t.get('開始照片檔名', ''),
-            t.get('結束照片檔名', '')
-        ))
-    
-    conn.commit()
-    conn.close()
-    
+    print(f"Metadata saved to {METADATA_PATH}")
     print(f"Database saved to {DB_PATH}")
     print("Ingestion complete.")
 
 if __name__ == "__main__":
-    ingest()
+    parser = argparse.ArgumentParser(description="Build the FAISS index and SQLite metadata from transcripts.csv")
+    parser.add_argument('--batch-size', type=int, default=None,
+                        help=f"CLIP batch size (default {DEFAULT_GPU_BATCH_SIZE} on GPU, {DEFAULT_BATCH_SIZE} on CPU)")
+    args = parser.parse_args()
+    ingest(batch_size=args.batch_size)
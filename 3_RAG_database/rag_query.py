@@ -1,14 +1,33 @@
 import os
 import sys
+import hashlib
+import pickle
 import sqlite3
+import threading
+from collections import OrderedDict
 import numpy as np
 import faiss
 import torch
 from transformers import CLIPProcessor, CLIPModel
 
+# 選用：安裝 onnxruntime 並匯出文字編碼器後（python rag_query.py --export-onnx），
+# 查詢時改用 ONNX Runtime 執行 CLIP 文字塔，CPU 上比 PyTorch 快數倍
+try:
+    import onnxruntime as ort
+except ImportError:
+    ort = None
+
 # --- Configuration ---
 CLIP_MODEL_NAME = "openai/clip-vit-base-patch32"
 TOP_K = 5
+# 單一 SQL 語句的 IN (...) 參數上限（舊版 SQLite 限制為 999）
+ROW_LOOKUP_CHUNK = 500
+# GPU FAISS 的暫存記憶體上限
+FAISS_GPU_TEMP_MEMORY = 256 * 1024 * 1024
+# 查詢向量 LRU 快取的筆數（以查詢文字為 key）
+EMBEDDING_CACHE_SIZE = 4096
+# 計算索引檔雜湊時每次讀取的位元組數
+INDEX_DIGEST_CHUNK = 1024 * 1024
 
 # 取得腳本所在目錄，使用上層目錄的共用 input/output 資料夾
 SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
@@ -19,50 +38,361 @@ OUTPUT_DIR = os.path.join(ROOT_DIR, 'output')
 SCREENSHOTS_DIR = os.path.join(OUTPUT_DIR, 'screenshots')
 DB_PATH = os.path.join(OUTPUT_DIR, 'rag_mm.db')
 INDEX_PATH = os.path.join(OUTPUT_DIR, 'transcript.index')
+METADATA_PATH = os.path.join(OUTPUT_DIR, 'metadata.pkl')
+ONNX_TEXT_ENCODER_PATH = os.path.join(OUTPUT_DIR, 'clip_text_encoder.onnx')
 
 # --- Globals for Models (Lazy loading) ---
-clip_model = None
+text_encoder = None
 clip_processor = None
+onnx_session = None
+num_threads = 0  # 0 表示沿用 torch / ONNX Runtime 的預設值
+device = 'cuda' if torch.cuda.is_available() else 'cpu'
+# 多個請求同時觸發第一次載入時，只讓其中一個執行緒載入與追蹤模型
+_models_lock = threading.Lock()
 
 def load_models():
-    global clip_model, clip_processor
-    if clip_model is None:
-        print("Loading CLIP model...")
-        clip_model = CLIPModel.from_pretrained(CLIP_MODEL_NAME)
-        clip_processor = CLIPProcessor.from_pretrained(CLIP_MODEL_NAME)
+    global text_encoder, clip_processor, onnx_session
+    if clip_processor is not None:
+        return
+    with _models_lock:
+        if clip_processor is not None:
+            return
+        # 模型重新載入時，舊的查詢向量快取一併作廢
+        clear_embedding_cache()
+        processor = CLIPProcessor.from_pretrained(CLIP_MODEL_NAME)
+        if device == 'cpu' and ort is not None and os.path.exists(ONNX_TEXT_ENCODER_PATH):
+            print("Loading ONNX CLIP text encoder...")
+            options = ort.SessionOptions()
+            options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+            options.intra_op_num_threads = num_threads
+            onnx_session = ort.InferenceSession(ONNX_TEXT_ENCODER_PATH, options, providers=["CPUExecutionProvider"])
+        else:
+            print("Loading CLIP model...")
+            model = CLIPModel.from_pretrained(CLIP_MODEL_NAME).eval()
+            if device == 'cuda':
+                # GPU 上以半精度推論
+                model = model.to(device).half()
+            else:
+                # int8 動態量化所有 Linear 層（CPU 上走 VNNI/AVX2 int8 GEMM），查詢只用到文字塔
+                model = torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+            text_encoder = trace_text_encoder(model, processor)
+        # 最後才設定 clip_processor：其他執行緒看到它不為 None 時，編碼器必定已就緒
+        clip_processor = processor
+
+def set_num_threads(n):
+    """設定 CLIP 推論與 FAISS 搜尋使用的執行緒數（需在載入模型前呼叫才會套用到 ONNX Runtime）"""
+    global num_threads
+    num_threads = n
+    torch.set_num_threads(n)
+    faiss.omp_set_num_threads(n)
+
+class TextFeatures(torch.nn.Module):
+    """CLIP 文字塔 + 投影層（匯出 ONNX 用）"""
+    
+    def __init__(self, model):
+        super().__init__()
+        self.model = model
+    
+    def forward(self, input_ids, attention_mask):
+        return self.model.get_text_features(input_ids=input_ids, attention_mask=attention_mask)
+
+class TextEncoder(TextFeatures):
+    """CLIP 文字塔 + 投影層 + L2 正規化（TorchScript 追蹤用，正規化併入同一張圖）"""
+    
+    def forward(self, input_ids, attention_mask):
+        x = super().forward(input_ids, attention_mask)
+        return x / x.norm(p=2, dim=-1, keepdim=True)
+
+def trace_text_encoder(model, processor):
+    """以 torch.jit.trace 將文字編碼器編譯為 TorchScript，並先執行暖機讓 profiling executor 完成特化"""
+    dummy = processor(text=["a photo of a cat", "a dog"], return_tensors="pt", padding=True, truncation=True)
+    example = (dummy["input_ids"].to(device), dummy["attention_mask"].to(device))
+    with torch.no_grad():
+        traced = torch.jit.trace(TextEncoder(model), example, check_trace=False)
+        for _ in range(2):
+            traced(*example)
+    return traced
+
+def export_text_encoder_onnx(path=ONNX_TEXT_ENCODER_PATH, quantize=True):
+    """將 CLIP 文字編碼器匯出為 ONNX（batch 與序列長度皆為動態維度），預設再做 int8 動態量化"""
+    model = CLIPModel.from_pretrained(CLIP_MODEL_NAME).eval()
+    processor = CLIPProcessor.from_pretrained(CLIP_MODEL_NAME)
+    dummy = processor(text=["a photo of a cat", "a dog"], return_tensors="pt", padding=True, truncation=True)
+    
+    quantize = quantize and ort is not None
+    export_path = path + ".fp32" if quantize else path
+    
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with torch.no_grad():
+        torch.onnx.export(
+            TextFeatures(model),
+            (dummy["input_ids"], dummy["attention_mask"]),
+            export_path,
+            input_names=["input_ids", "attention_mask"],
+            output_names=["text_embeds"],
+            dynamic_axes={
+                "input_ids": {0: "batch", 1: "sequence"},
+                "attention_mask": {0: "batch", 1: "sequence"},
+                "text_embeds": {0: "batch"},
+            },
+            opset_version=14,
+        )
+    
+    if quantize:
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+        quantize_dynamic(export_path, path, weight_type=QuantType.QInt8)
+        os.remove(export_path)
+    print(f"ONNX text encoder saved to {path}")
+
+# --- Cached search resources (opened once, reused across queries) ---
+_resources = None  # (FAISS 索引, {faiss_id: 結果欄位} 或 None)
+_index_lock = threading.Lock()
+_index_mtime = None
+_gpu_resources = None
+_embedding_cache = OrderedDict()
+_embedding_cache_lock = threading.Lock()
+_local = threading.local()
 
 def get_db_connection():
-    conn = sqlite3.connect(DB_PATH)
-    conn.row_factory = sqlite3.Row
+    """取得目前執行緒專用的 SQLite 連線（第一次使用時開啟）"""
+    conn = getattr(_local, 'conn', None)
+    if conn is None:
+        conn = sqlite3.connect(DB_PATH, check_same_thread=False)
+        conn.row_factory = sqlite3.Row
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.execute('PRAGMA temp_store=MEMORY')
+        conn.execute('PRAGMA cache_size=-65536')
+        conn.execute('PRAGMA mmap_size=268435456')
+        # rag_ingest 寫入時等待鎖釋放，而不是直接回報 database is locked
+        conn.execute('PRAGMA busy_timeout=5000')
+        _local.conn = conn
     return conn
 
+def _read_index():
+    # 解決 FAISS 在 Windows 上讀取中文路徑的問題
+    # 先切換當前工作目錄到索引檔所在資料夾
+    original_cwd = os.getcwd()
+    index_dir = os.path.dirname(INDEX_PATH)
+    index_filename = os.path.basename(INDEX_PATH)
+    
+    # IVF 索引的倒排表以 mmap 映射、按需分頁載入（多個 worker 行程共用同一份 page cache）；
+    # 其餘索引類型會忽略此旗標照常讀入。FAISS 的 mmap 不支援 Windows
+    io_flags = 0 if os.name == 'nt' else faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY
+    
+    try:
+        os.chdir(index_dir)
+        return faiss.read_index(index_filename, io_flags)
+    finally:
+        os.chdir(original_cwd)
+
+def _index_to_gpu(index):
+    """有 CUDA 與 faiss-gpu 時將索引搬到 GPU；不支援的索引類型（如 HNSW）維持在 CPU"""
+    global _gpu_resources
+    if device != 'cuda' or not hasattr(faiss, 'StandardGpuResources'):
+        return index
+    try:
+        if _gpu_resources is None:
+            # 資源只建立一次並保留，避免每次搬移重新配置暫存記憶體
+            _gpu_resources = faiss.StandardGpuResources()
+            _gpu_resources.setTempMemory(FAISS_GPU_TEMP_MEMORY)
+        return faiss.index_cpu_to_gpu(_gpu_resources, 0, index)
+    except Exception as e:
+        print(f"FAISS index stays on CPU: {e}")
+        return index
+
+def index_file_digest(path=INDEX_PATH):
+    """索引檔內容的雜湊：rag_ingest 將它寫入 metadata.pkl，作為索引與中繼資料屬於同一次建立的標記"""
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(INDEX_DIGEST_CHUNK), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def _read_metadata(index_digest):
+    """
+    讀取 rag_ingest 產生的 metadata.pkl，回傳 {faiss_id: 結果欄位}。
+    檔案不存在、或與已載入的索引不是同一次 rag_ingest 產生時（例如索引替換失敗，或讀取時恰好在兩檔替換之間）
+    回傳 None，改由 SQLite 查詢。
+    """
+    try:
+        with open(METADATA_PATH, 'rb') as f:
+            metadata = pickle.load(f)
+    except FileNotFoundError:
+        return None
+    if metadata.get('index_digest') != index_digest:
+        return None
+    return metadata['rows']
+
+def _load_resources():
+    """讀取索引與對應的中繼資料；讀取期間索引檔被替換時重讀，確保比對的雜湊就是實際載入的那一份"""
+    while True:
+        before = os.stat(INDEX_PATH)
+        index_digest = index_file_digest()
+        # 搜尋參數（IVF 的 nprobe、HNSW 的 efSearch）由 rag_ingest 寫入索引檔，這裡直接沿用
+        index = _read_index()
+        after = os.stat(INDEX_PATH)
+        if (before.st_ino, before.st_mtime_ns) == (after.st_ino, after.st_mtime_ns):
+            return _index_to_gpu(index), _read_metadata(index_digest)
+
+def get_search_resources():
+    """
+    取得 (FAISS 索引, 中繼資料)，只在第一次使用或索引檔被 rag_ingest 替換後從磁碟讀取。
+    中繼資料為 {faiss_id: 結果欄位} 的 dict，無法使用時為 None。
+    """
+    global _resources, _index_mtime
+    # 其他 worker 行程重建索引時不會呼叫本行程的 reset_index，改以檔案修改時間判斷
+    mtime = os.stat(INDEX_PATH).st_mtime_ns
+    resources = _resources
+    if resources is None or mtime != _index_mtime:
+        with _index_lock:
+            if _resources is None or mtime != _index_mtime:
+                _resources = _load_resources()
+                _index_mtime = mtime
+            resources = _resources
+    return resources
+
+def get_index():
+    """取得 FAISS 索引"""
+    return get_search_resources()[0]
+
+def reset_index():
+    """清除快取的索引與中繼資料，重新建立索引（rag_ingest）後呼叫，下次搜尋時會重新讀取"""
+    global _resources
+    with _index_lock:
+        _resources = None
+
+def clear_embedding_cache():
+    """清除查詢向量快取"""
+    with _embedding_cache_lock:
+        _embedding_cache.clear()
+
+def _encode_texts(texts):
+    """以 CLIP 編碼多筆文字，回傳 (len(texts), d) 的 float32 陣列"""
+    if onnx_session is not None:
+        inputs = clip_processor(text=list(texts), return_tensors="np", padding=True, truncation=True)
+        outputs = onnx_session.run(None, {
+            "input_ids": inputs["input_ids"].astype(np.int64),
+            "attention_mask": inputs["attention_mask"].astype(np.int64),
+        })[0]
+        embedding = np.ascontiguousarray(outputs, dtype=np.float32)
+        # FAISS 內建的 L2 正規化（原地運算，不另配置陣列）
+        faiss.normalize_L2(embedding)
+        return embedding
+    
+    inputs = clip_processor(text=list(texts), return_tensors="pt", padding=True, truncation=True)
+    with torch.inference_mode():
+        embedding = text_encoder(inputs["input_ids"].to(device), inputs["attention_mask"].to(device))
+        # FAISS 需要 C-contiguous 的 float32
+        return np.ascontiguousarray(embedding.float().cpu().numpy(), dtype=np.float32)
+
+def get_text_embeddings(texts):
+    """批次取得多筆文字的向量嵌入，回傳 (len(texts), d) 的 float32 陣列；重複的查詢直接取自 LRU 快取"""
+    load_models()
+    texts = list(texts)
+    vectors = {}
+    with _embedding_cache_lock:
+        for text in texts:
+            vec = _embedding_cache.get(text)
+            if vec is not None:
+                _embedding_cache.move_to_end(text)
+                vectors[text] = vec
+    
+    # 未命中的查詢（去重後）一次送進 CLIP
+    misses = list(dict.fromkeys(t for t in texts if t not in vectors))
+    if misses:
+        encoded = _encode_texts(misses)
+        with _embedding_cache_lock:
+            for text, vec in zip(misses, encoded):
+                vec = vec.copy()
+                _embedding_cache[text] = vec
+                vectors[text] = vec
+            while len(_embedding_cache) > EMBEDDING_CACHE_SIZE:
+                _embedding_cache.popitem(last=False)
+    
+    return np.stack([vectors[t] for t in texts])
+
 def get_text_embedding(text):
     """取得文字的向量嵌入"""
-    load_models()
-    inputs = clip_processor(text=[text], return_tensors="pt", padding=True, truncation=True)
-    with torch.no_grad():
-        outputs = clip_model.get_text_features(**inputs)
-        embedding = outputs / outputs.norm(p=2, dim=-1, keepdim=True)
-        return embedding.numpy()
+    return get_text_embeddings([text])
 
-def search(query_text, top_k=None):
+RESULT_COLUMNS = (
+    "faiss_id, video_file, start_time, end_time, speaker, content, "
+    "start_image, end_image, start_image_url, end_image_url"
+)
+
+def _fetch_rows(cursor, ids):
+    """以 WHERE faiss_id IN (...) 一次取回多筆逐字稿，回傳 {faiss_id: row}"""
+    ids = sorted({int(i) for i in ids if i != -1})
+    rows = {}
+    for i in range(0, len(ids), ROW_LOOKUP_CHUNK):
+        chunk = ids[i:i+ROW_LOOKUP_CHUNK]
+        placeholders = ','.join('?' * len(chunk))
+        cursor.execute(
+            f"SELECT {RESULT_COLUMNS} FROM transcripts WHERE faiss_id IN ({placeholders})",
+            chunk
+        )
+        for row in cursor:
+            rows[row['faiss_id']] = row
+    return rows
+
+def _row_to_result(row, score):
+    # 圖片 URL 已在 rag_ingest 時算好（截圖不存在則為 NULL）
+    return {
+        "score": float(score),
+        "video_file": row['video_file'],
+        "start_time": row['start_time'],
+        "end_time": row['end_time'],
+        "speaker": row['speaker'],
+        "content": row['content'],
+        "start_image_url": row['start_image_url'],
+        "end_image_url": row['end_image_url']
+    }
+
+def _build_results(rows, ids, scores):
+    """依 FAISS 回傳的 id 與分數（保持原排序），組出單一查詢的結果列表"""
+    results = []
+    for idx, score in zip(ids, scores):
+        if idx != -1:
+            row = rows.get(int(idx))
+            
+            if row:
+                results.append(_row_to_result(row, score))
+    return results
+
+def search_ids_batch(query_texts, top_k):
     """
-    搜尋與查詢文字最相關的逐字稿片段。
+    一次完成多筆查詢的 CLIP 編碼與 FAISS 搜尋（nq 筆一起計算），不查詢逐字稿內容。
+    回傳 (D, I, metadata)：分數與 faiss_id 皆為 (len(query_texts), top_k) 的陣列，
+    metadata 為與此索引同時讀入的中繼資料（無法使用時為 None），交給 lookup_results / iter_rows 取出結果。
+    索引不存在或發生錯誤時直接拋出例外。
+    """
+    query_vecs = get_text_embeddings(query_texts)
+    index, metadata = get_search_resources()
+    D, I = index.search(query_vecs, top_k)
+    return D, I, metadata
+
+def lookup_results(D, I, metadata):
+    """依 search_ids_batch 的輸出取出每筆查詢的結果列表（格式同 search()）"""
+    if metadata is not None:
+        # 直接查記憶體中的中繼資料，不經過 SQLite
+        rows = metadata
+    else:
+        # 所有查詢的命中結果只需一次資料庫查詢
+        rows = _fetch_rows(get_db_connection().cursor(), I.ravel())
+    return [_build_results(rows, I[q], D[q]) for q in range(len(I))]
+
+def search_batch(query_texts, top_k=None):
+    """
+    一次搜尋多筆查詢：CLIP 編碼與 FAISS 搜尋都只執行一次（nq 筆一起計算）。
     
     Args:
-        query_text: 查詢文字
-        top_k: 返回的結果數量（預設為 TOP_K）
+        query_texts: 查詢文字列表
+        top_k: 每筆查詢返回的結果數量（預設為 TOP_K）
     
     Returns:
-        list: 包含搜尋結果的列表，每個結果包含：
-            - score: 相似度分數
-            - video_file: 影片檔名
-            - start_time: 開始時間
-            - end_time: 結束時間
-            - speaker: 講者
-            - content: 逐字稿內容
-            - start_image: 開始圖片的完整路徑
-            - end_image: 結束圖片的完整路徑
+        list: 與 query_texts 對應的結果列表（格式同 search()），
+              若資料庫或索引不存在則回傳包含 error 的 dict
     """
     if top_k is None:
         top_k = TOP_K
@@ -73,67 +403,75 @@ def search(query_text, top_k=None):
     if not os.path.exists(INDEX_PATH):
         return {"error": "Index not found. Please run rag_ingest.py first."}
 
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    
-    # Embed Query
-    query_vec = get_text_embedding(query_text)
-    
-    # Search FAISS Index
-    results = []
+    # Embed all queries in one forward pass and search the FAISS index
     try:
-        # 解決 FAISS 在 Windows 上讀取中文路徑的問題
-        # 先切換當前工作目錄到索引檔所在資料夾
-        original_cwd = os.getcwd()
-        index_dir = os.path.dirname(INDEX_PATH)
-        index_filename = os.path.basename(INDEX_PATH)
-        
-        try:
-            os.chdir(index_dir)
-            index = faiss.read_index(index_filename)
-        finally:
-            os.chdir(original_cwd)
-            
-        D, I = index.search(query_vec, top_k)
-        
-        for idx, score in zip(I[0], D[0]):
-            if idx != -1:
-                row = cursor.execute(
-                    "SELECT * FROM transcripts WHERE faiss_id=?", 
-                    (int(idx),)
-                ).fetchone()
-                
-                if row:
-                    # Build full image paths
-                    start_image_path = None
-                    end_image_path = None
-                    
-                    if row['start_image']:
-                        start_image_path = os.path.join(SCREENSHOTS_DIR, row['start_image'])
-                        if not os.path.exists(start_image_path):
-                            start_image_path = None
-                    
-                    if row['end_image']:
-                        end_image_path = os.path.join(SCREENSHOTS_DIR, row['end_image'])
-                        if not os.path.exists(end_image_path):
-                            end_image_path = None
-                    
-                    results.append({
-                        "score": float(score),
-                        "video_file": row['video_file'],
-                        "start_time": row['start_time'],
-                        "end_time": row['end_time'],
-                        "speaker": row['speaker'],
-                        "content": row['content'],
-                        "start_image": start_image_path,
-                        "end_image": end_image_path
-                    })
+        D, I, metadata = search_ids_batch(query_texts, top_k)
+        return lookup_results(D, I, metadata)
     except Exception as e:
         print(f"Error searching index: {e}")
         return {"error": str(e)}
 
-    conn.close()
-    return results
+def iter_search(query_text, top_k=None):
+    """
+    逐筆產生搜尋結果（格式同 search() 的每個元素），依分數由高到低。
+    CLIP 編碼與 FAISS 搜尋完成後即開始產生；沒有 metadata.pkl 時，資料庫的每一列讀出後立刻交給呼叫端。
+    呼叫前須確認資料庫與索引存在；發生錯誤時直接拋出例外。
+    """
+    if top_k is None:
+        top_k = TOP_K
+    
+    D, I, metadata = search_ids_batch([query_text], top_k)
+    yield from iter_rows(D[0], I[0], metadata)
+
+def iter_rows(scores, ids, metadata):
+    """
+    依單一查詢的 FAISS 分數與 faiss_id（search_ids_batch 輸出的一列）逐筆產生結果，依分數由高到低。
+    沒有中繼資料時，資料庫的每一列讀出後立刻交給呼叫端。
+    """
+    if metadata is not None:
+        yield from _build_results(metadata, ids, scores)
+        return
+    
+    scores = {int(idx): score for idx, score in zip(ids, scores) if idx != -1}
+    if not scores:
+        return
+    
+    # 以 ORDER BY CASE 讓 SQLite 直接依 FAISS 的排名回傳
+    ids = list(scores)
+    placeholders = ','.join('?' * len(ids))
+    ranking = ' '.join(f'WHEN ? THEN {rank}' for rank in range(len(ids)))
+    cursor = get_db_connection().cursor()
+    cursor.execute(
+        f"SELECT {RESULT_COLUMNS} FROM transcripts WHERE faiss_id IN ({placeholders}) "
+        f"ORDER BY CASE faiss_id {ranking} END",
+        ids + ids
+    )
+    for row in cursor:
+        yield _row_to_result(row, scores[row['faiss_id']])
+
+def search(query_text, top_k=None):
+    """
+    搜尋與查詢文字最相關的逐字稿片段。
+    
+    Args:
+        query_text: 查詢文字
+        top_k: 返回的結果數量（預設為 TOP_K）
+    
+    Returns:
+        list: 包含搜尋結果的列表，每個結果包含：
+            - score: 相似度分數
+            - video_file: 影片檔名
+            - start_time: 開始時間
+            - end_time: 結束時間
+            - speaker: 講者
+            - content: 逐字稿內容
+            - start_image_url: 開始圖片的 URL（/api/image/<檔名>，無圖片時為 None）
+            - end_image_url: 結束圖片的 URL（/api/image/<檔名>，無圖片時為 None）
+    """
+    results = search_batch([query_text], top_k)
+    if isinstance(results, dict):
+        return results
+    return results[0]
 
 def print_results(results):
     """將搜尋結果印出到終端機"""
@@ -149,11 +487,15 @@ def print_results(results):
         print(f"Time: {item['start_time']} - {item['end_time']}")
         print(f"Speaker: {item['speaker']}")
         print(f"Content: {item['content']}")
-        print(f"Start Image: {item['start_image']}")
-        print(f"End Image: {item['end_image']}")
+        print(f"Start Image: {item['start_image_url']}")
+        print(f"End Image: {item['end_image_url']}")
         print()
 
 def main():
+    if sys.argv[1:] == ["--export-onnx"]:
+        export_text_encoder_onnx()
+        return
+    
     if len(sys.argv) > 1:
         query_text = " ".join(sys.argv[1:])
         results = search(query_text)
@@ -7,11 +7,16 @@ import os
 import sys
 import json
 import time
+import queue
+import sqlite3
 import threading
 import traceback
+from concurrent.futures import Future
+from contextlib import closing
 from pathlib import Path
-from flask import Flask, request, jsonify, send_from_directory, send_file
+from flask import Flask, Response, request, jsonify, send_from_directory, send_file, abort, stream_with_context
 from flask_cors import CORS
+from werkzeug.security import safe_join
 from werkzeug.utils import secure_filename
 
 # 設定路徑
@@ -21,51 +26,236 @@ INPUT_DIR = ROOT_DIR / 'input'
 OUTPUT_DIR = ROOT_DIR / 'output'
 SCREENSHOTS_DIR = OUTPUT_DIR / 'screenshots'
 
+# 每個 worker 行程使用的 CPU 執行緒數：核心數平均分給各 worker（gunicorn 以 WEB_CONCURRENCY 指定 worker 數），
+# CLIP（torch / ONNX Runtime）與 FAISS 共用同一個上限，避免兩組 OpenMP 執行緒互搶核心
+WORKER_THREADS = int(os.environ.get('OMP_NUM_THREADS') or
+                     max(1, (os.cpu_count() or 1) // int(os.environ.get('WEB_CONCURRENCY', '1'))))
+# OpenMP / MKL 只在初始化時讀取環境變數，必須在載入 numpy / torch / faiss 前設定
+os.environ.setdefault('OMP_NUM_THREADS', str(WORKER_THREADS))
+os.environ.setdefault('MKL_NUM_THREADS', str(WORKER_THREADS))
+# rag_ingest / rag_query 匯入時以 torch.cuda.is_available() 決定裝置；改用 NVML 偵測 GPU 而不初始化 CUDA，
+# gunicorn --preload 時主行程匯入本模組後 fork 出的 worker 才能各自使用 CUDA（需在匯入 torch 前設定）
+os.environ.setdefault('PYTORCH_NVML_BASED_CUDA_CHECK', '1')
+
 # 將各模組的路徑加入 sys.path
 sys.path.insert(0, str(ROOT_DIR / '1_逐字稿擷取'))
 sys.path.insert(0, str(ROOT_DIR / '2_逐字稿圖片擷取'))
 sys.path.insert(0, str(ROOT_DIR / '3_RAG_database'))
 
+# 各處理模組在伺服器啟動時載入一次，之後每次上傳與查詢都直接沿用
+# （FAISS 索引與資料庫連線會在 rag_query 模組內快取重複使用）
+import transcribe
+import extract_screenshots
+import rag_ingest
+import rag_query
+
+rag_query.set_num_threads(WORKER_THREADS)
+
 # 設定 Flask
 app = Flask(__name__, static_folder=str(ROOT_DIR / '5_frontend'))
 CORS(app)
 
+# 由前端代理伺服器（Apache mod_xsendfile、lighttpd）直接傳送檔案時設定 USE_X_SENDFILE=1
+app.config['USE_X_SENDFILE'] = os.environ.get('USE_X_SENDFILE') == '1'
+
+# 截圖的瀏覽器快取時間（秒）：檔名只依 CSV 列號命名（img_<列號>_start.jpg），
+# 每次上傳新影片都會以同名檔案覆寫，因此不長期快取，每次都以 ETag / Last-Modified 驗證（未變動時回傳 304）
+IMAGE_MAX_AGE = 0
+
 # 允許的影片格式
 ALLOWED_EXTENSIONS = {'mp4', 'mkv', 'avi', 'mov', 'wmv', 'flv', 'webm', 'm4v'}
 
-# 處理狀態
-processing_status = {
-    'is_processing': False,
-    'current_stage': None,
-    'progress': 0,
-    'message': '',
-    'error': None
-}
+# 搜尋結果數量上限：同一批次的請求會以最大的 top_k 一起搜尋，過大的值會拖慢所有人
+MAX_TOP_K = 50
+
+# 處理狀態與工作佇列存放在 SQLite，API worker 行程（gunicorn）與處理影片的 worker.py 共用同一份
+STATUS_DB_PATH = OUTPUT_DIR / 'server_status.db'
+
+def _status_db():
+    conn = sqlite3.connect(str(STATUS_DB_PATH), timeout=30)
+    conn.row_factory = sqlite3.Row
+    return conn
+
+def init_status(reset=False):
+    """建立狀態表與工作佇列；reset=True 時收拾前次 worker 中斷留下的狀態（僅在處理 worker 啟動時呼叫）"""
+    OUTPUT_DIR.mkdir(exist_ok=True)
+    with closing(_status_db()) as conn, conn:
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS processing_status (
+                id INTEGER PRIMARY KEY CHECK (id = 1),
+                is_processing INTEGER NOT NULL,
+                current_stage TEXT,
+                progress INTEGER NOT NULL,
+                message TEXT NOT NULL,
+                error TEXT
+            )
+        ''')
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS jobs (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                filename TEXT NOT NULL,
+                state TEXT NOT NULL DEFAULT 'queued',
+                created_at TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+        conn.execute("INSERT OR IGNORE INTO processing_status VALUES (1, 0, NULL, 0, '', NULL)")
+        if reset:
+            # 上次 worker 中斷時正在執行的工作無法接續，標記為失敗並回報錯誤；
+            # 排隊中的工作（worker 停止期間上傳的影片）保留給本次 worker 處理
+            interrupted = conn.execute("UPDATE jobs SET state = 'failed' WHERE state = 'running'").rowcount
+            if interrupted:
+                error_msg = '處理 worker 在處理途中停止'
+                conn.execute(
+                    'UPDATE processing_status SET is_processing = 0, current_stage = ?, progress = 0, '
+                    'message = ?, error = ? WHERE id = 1',
+                    ('error', f'處理失敗: {error_msg}', error_msg)
+                )
+            elif conn.execute("SELECT 1 FROM jobs WHERE state = 'queued' LIMIT 1").fetchone() is None:
+                # 沒有待處理的工作：清除上傳途中失敗而殘留的處理中標記
+                conn.execute('UPDATE processing_status SET is_processing = 0 WHERE id = 1')
+
+def get_processing_status():
+    """讀取目前的處理狀態（格式同 /api/status 回應）"""
+    with closing(_status_db()) as conn:
+        row = conn.execute('SELECT * FROM processing_status WHERE id = 1').fetchone()
+    status = {key: row[key] for key in ('current_stage', 'progress', 'message', 'error')}
+    status['is_processing'] = bool(row['is_processing'])
+    return status
+
+def try_start_processing():
+    """若目前沒有影片在處理，標記為處理中並回傳 True（跨行程的原子操作）"""
+    with closing(_status_db()) as conn, conn:
+        cursor = conn.execute(
+            'UPDATE processing_status SET is_processing = 1, error = NULL WHERE id = 1 AND is_processing = 0'
+        )
+        return cursor.rowcount == 1
+
+def finish_processing():
+    with closing(_status_db()) as conn, conn:
+        conn.execute('UPDATE processing_status SET is_processing = 0 WHERE id = 1')
+
+def enqueue_job(filename):
+    """將影片加入處理佇列"""
+    with closing(_status_db()) as conn, conn:
+        conn.execute('INSERT INTO jobs (filename) VALUES (?)', (filename,))
+
+def claim_next_job():
+    """取出最早排入的工作並標記為執行中，回傳 (job_id, filename)；佇列為空時回傳 None"""
+    with closing(_status_db()) as conn:
+        # IMMEDIATE 先取得寫入鎖，多個 worker 不會取到同一筆工作
+        conn.execute('BEGIN IMMEDIATE')
+        row = conn.execute("SELECT id, filename FROM jobs WHERE state = 'queued' ORDER BY id LIMIT 1").fetchone()
+        if row is not None:
+            conn.execute("UPDATE jobs SET state = 'running' WHERE id = ?", (row['id'],))
+        conn.commit()
+    return (row['id'], row['filename']) if row is not None else None
+
+def finish_job(job_id, succeeded):
+    with closing(_status_db()) as conn, conn:
+        conn.execute('UPDATE jobs SET state = ? WHERE id = ?', ('done' if succeeded else 'failed', job_id))
+
+init_status()
+
+class SearchBatcher:
+    """
+    搜尋請求的微批次處理器：同時到達的 /api/search 與 /api/search/stream 請求會被合併，
+    由單一背景執行緒一次完成 CLIP 編碼與 FAISS 搜尋，再將結果分回各請求。
+    所有查詢都經過這個執行緒，CLIP 推論不會在多個請求執行緒上並行而超出 WORKER_THREADS 的核心配額。
+    """
+    
+    def __init__(self, max_batch=32, max_wait=0.005):
+        self.max_batch = max_batch
+        self.max_wait = max_wait  # 秒；等待更多請求加入同一批的上限
+        self.queue = queue.Queue()
+        self._worker = None
+        self._lock = threading.Lock()
+    
+    def search(self, query, top_k):
+        """送出一筆查詢並等待結果（格式同 rag_query.search）"""
+        return self._submit(query, top_k, ids_only=False)
+    
+    def search_ids(self, query, top_k):
+        """送出一筆查詢，只等待 FAISS 搜尋完成，回傳 (分數, faiss_id, metadata)，交給 rag_query.iter_rows 逐筆取出結果"""
+        return self._submit(query, top_k, ids_only=True)
+    
+    def _submit(self, query, top_k, ids_only):
+        self._ensure_worker()
+        future = Future()
+        self.queue.put((query, top_k, future, ids_only))
+        return future.result()
+    
+    def _ensure_worker(self):
+        # 延遲到第一次查詢才啟動背景執行緒
+        if self._worker is None or not self._worker.is_alive():
+            with self._lock:
+                if self._worker is None or not self._worker.is_alive():
+                    self._worker = threading.Thread(target=self._run, daemon=True)
+                    self._worker.start()
+    
+    def _collect_batch(self):
+        items = [self.queue.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(items) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                items.append(self.queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return items
+    
+    def _search(self, items):
+        # 以最大的 top_k 搜尋一次，再依各請求的 top_k 截斷
+        max_top_k = max(item[1] for item in items)
+        D, I, metadata = rag_query.search_ids_batch([item[0] for item in items], max_top_k)
+        
+        # 需要完整結果的請求一次查完資料庫；串流請求自行逐筆讀取
+        wanted = [q for q, item in enumerate(items) if not item[3]]
+        results = iter(rag_query.lookup_results(D[wanted], I[wanted], metadata) if wanted else [])
+        
+        # 全部算完才開始回填，途中失敗時 _run 仍可逐筆重試
+        for q, (_, top_k, future, ids_only) in enumerate(items):
+            if ids_only:
+                future.set_result((D[q, :top_k], I[q, :top_k], metadata))
+            else:
+                future.set_result(next(results)[:top_k])
+    
+    def _run(self):
+        while True:
+            items = self._collect_batch()
+            try:
+                self._search(items)
+            except Exception as e:
+                if len(items) == 1:
+                    items[0][2].set_exception(e)
+                    continue
+                # 整批失敗時逐筆重試，只讓出錯的請求失敗，不波及同批的其他使用者
+                for item in items:
+                    try:
+                        self._search([item])
+                    except Exception as item_error:
+                        item[2].set_exception(item_error)
+
+search_batcher = SearchBatcher()
 
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
 def update_status(stage, progress, message, error=None):
-    global processing_status
-    processing_status['current_stage'] = stage
-    processing_status['progress'] = progress
-    processing_status['message'] = message
-    processing_status['error'] = error
+    with closing(_status_db()) as conn, conn:
+        conn.execute(
+            'UPDATE processing_status SET current_stage = ?, progress = ?, message = ?, error = ? WHERE id = 1',
+            (stage, progress, message, error)
+        )
     print(f"[{stage}] {progress}% - {message}")
 
 def process_video(video_filename):
-    """在背景處理影片的完整流程"""
-    global processing_status
-    
-    processing_status['is_processing'] = True
-    processing_status['error'] = None
-    
+    """處理影片的完整流程（呼叫前須已由 try_start_processing 標記為處理中），成功時回傳 True"""
     try:
         # 階段 1: 逐字稿擷取
         update_status('transcribe', 10, '開始轉錄影片...')
         
-        # 動態引入模組
-        transcribe_path = ROOT_DIR / '1_逐字稿擷取' / 'transcribe.py'
         api_key_path = ROOT_DIR / '1_逐字稿擷取' / 'api_key.json'
         
         # 載入 API 金鑰
@@ -73,12 +263,6 @@ def process_video(video_filename):
             config = json.load(f)
         api_key = config['openai']['api_key']
         
-        # 執行轉錄
-        import importlib.util
-        spec = importlib.util.spec_from_file_location("transcribe", transcribe_path)
-        transcribe_module = importlib.util.module_from_spec(spec)
-        spec.loader.exec_module(transcribe_module)
-        
         video_path = INPUT_DIR / video_filename
         temp_dir = ROOT_DIR / 'temp'
         temp_dir.mkdir(exist_ok=True)
@@ -86,14 +270,14 @@ def process_video(video_filename):
         
         # 提取音訊
         update_status('transcribe', 20, '提取音訊中...')
-        audio_path = transcribe_module.extract_audio_from_video(video_path, temp_dir)
+        audio_path = transcribe.extract_audio_from_video(video_path, temp_dir)
         
         if audio_path is None:
             raise Exception("無法提取音訊")
         
         # 轉錄
         update_status('transcribe', 30, '使用 GPT-4o 轉錄中（這可能需要幾分鐘）...')
-        transcript_result = transcribe_module.transcribe_audio_gpt4o(audio_path, api_key)
+        transcript_result = transcribe.transcribe_audio_gpt4o(audio_path, api_key)
         
         if not transcript_result['success']:
             raise Exception(f"轉錄失敗: {transcript_result.get('error')}")
@@ -111,11 +295,11 @@ def process_video(video_filename):
         }
         
         # 儲存 CSV
-        transcribe_module.save_to_csv([result], OUTPUT_DIR / 'transcripts.csv')
+        transcribe.save_to_csv([result], OUTPUT_DIR / 'transcripts.csv')
         
         # 儲存詳細逐字稿
         detail_path = OUTPUT_DIR / f"{video_path.stem}_transcript.md"
-        transcribe_module.save_detailed_transcript(result, detail_path)
+        transcribe.save_detailed_transcript(result, detail_path)
         
         # 清理暫存
         import shutil
@@ -125,34 +309,40 @@ def process_video(video_filename):
         # 階段 2: 截圖擷取
         update_status('screenshots', 50, '開始擷取截圖...')
         
-        extract_path = ROOT_DIR / '2_逐字稿圖片擷取' / 'extract_screenshots.py'
-        spec = importlib.util.spec_from_file_location("extract_screenshots", extract_path)
-        extract_module = importlib.util.module_from_spec(spec)
-        spec.loader.exec_module(extract_module)
-        
         update_status('screenshots', 60, '擷取影片畫面中...')
-        extract_module.extract_frames()
+        extract_screenshots.extract_frames()
         
         # 階段 3: RAG 資料庫
         update_status('rag', 70, '建立向量索引...')
         
-        ingest_path = ROOT_DIR / '3_RAG_database' / 'rag_ingest.py'
-        spec = importlib.util.spec_from_file_location("rag_ingest", ingest_path)
-        ingest_module = importlib.util.module_from_spec(spec)
-        spec.loader.exec_module(ingest_module)
-        
         update_status('rag', 80, '載入 CLIP 模型並產生嵌入向量...')
-        ingest_module.ingest()
+        rag_ingest.ingest()
+        
+        # 索引已重建，讓搜尋模組下次重新讀取
+        rag_query.reset_index()
         
         update_status('complete', 100, '處理完成！')
+        return True
         
     except Exception as e:
         error_msg = str(e)
         traceback.print_exc()
         update_status('error', 0, f'處理失敗: {error_msg}', error_msg)
+        return False
     
     finally:
-        processing_status['is_processing'] = False
+        finish_processing()
+
+def run_worker(poll_interval=1.0):
+    """處理 worker 主迴圈：依序從佇列取出影片並執行 process_video（不會返回）"""
+    init_status(reset=True)
+    while True:
+        job = claim_next_job()
+        if job is None:
+            time.sleep(poll_interval)
+            continue
+        job_id, filename = job
+        finish_job(job_id, process_video(filename))
 
 # ===== API 路由 =====
 
@@ -169,11 +359,6 @@ def serve_static(filename):
 @app.route('/api/upload', methods=['POST'])
 def upload_video():
     """上傳影片並開始處理"""
-    global processing_status
-    
-    if processing_status['is_processing']:
-        return jsonify({'error': '目前有影片正在處理中，請稍候'}), 400
-    
     if 'video' not in request.files:
         return jsonify({'error': '未選擇檔案'}), 400
     
@@ -185,15 +370,22 @@ def upload_video():
     if not allowed_file(file.filename):
         return jsonify({'error': f'不支援的檔案格式，請上傳 {", ".join(ALLOWED_EXTENSIONS)} 格式'}), 400
     
-    # 儲存檔案
-    INPUT_DIR.mkdir(exist_ok=True)
-    filename = secure_filename(file.filename)
-    file_path = INPUT_DIR / filename
-    file.save(str(file_path))
+    if not try_start_processing():
+        return jsonify({'error': '目前有影片正在處理中，請稍候'}), 400
     
-    # 在背景執行處理
-    thread = threading.Thread(target=process_video, args=(filename,))
-    thread.start()
+    try:
+        # 儲存檔案
+        INPUT_DIR.mkdir(exist_ok=True)
+        filename = secure_filename(file.filename)
+        file_path = INPUT_DIR / filename
+        file.save(str(file_path))
+        
+        # 交給處理 worker（worker.py 或開發模式下的背景執行緒）
+        update_status('queued', 0, '等待處理...')
+        enqueue_job(filename)
+    except Exception:
+        finish_processing()
+        raise
     
     return jsonify({
         'success': True,
@@ -204,64 +396,99 @@ def upload_video():
 @app.route('/api/status')
 def get_status():
     """取得處理狀態"""
-    return jsonify(processing_status)
+    return jsonify(get_processing_status())
+
+def rag_database_ready():
+    """檢查 RAG 資料庫與索引是否存在"""
+    return (OUTPUT_DIR / 'rag_mm.db').exists() and (OUTPUT_DIR / 'transcript.index').exists()
+
+def parse_top_k(value):
+    """解析 top_k，不是 1..MAX_TOP_K 的整數時回傳 None"""
+    if isinstance(value, bool):
+        return None
+    try:
+        top_k = int(value)
+    except (TypeError, ValueError):
+        return None
+    return top_k if 1 <= top_k <= MAX_TOP_K else None
+
+def sse_event(event, data):
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
 
 @app.route('/api/search', methods=['POST'])
 def search():
     """語意搜尋"""
-    data = request.get_json()
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        return jsonify({'error': '請求內容必須是 JSON 物件'}), 400
     query = data.get('query', '')
-    top_k = data.get('top_k', 5)
+    top_k = parse_top_k(data.get('top_k', 5))
     
-    if not query:
+    if not isinstance(query, str) or not query:
         return jsonify({'error': '請輸入查詢文字'}), 400
     
-    # 檢查 RAG 資料庫是否存在
-    db_path = OUTPUT_DIR / 'rag_mm.db'
-    index_path = OUTPUT_DIR / 'transcript.index'
+    if top_k is None:
+        return jsonify({'error': f'top_k 必須是 1 到 {MAX_TOP_K} 之間的整數'}), 400
     
-    if not db_path.exists() or not index_path.exists():
+    if not rag_database_ready():
         return jsonify({'error': '尚未建立資料庫，請先上傳並處理影片'}), 400
     
     try:
-        # 動態引入搜尋模組
-        query_path = ROOT_DIR / '3_RAG_database' / 'rag_query.py'
-        import importlib.util
-        spec = importlib.util.spec_from_file_location("rag_query", query_path)
-        query_module = importlib.util.module_from_spec(spec)
-        spec.loader.exec_module(query_module)
-        
-        results = query_module.search(query, top_k=top_k)
-        
-        if isinstance(results, dict) and 'error' in results:
-            return jsonify(results), 400
-        
-        # 轉換圖片路徑為 API URL
-        for item in results:
-            if item.get('start_image'):
-                img_name = os.path.basename(item['start_image'])
-                item['start_image_url'] = f'/api/image/{img_name}'
-            else:
-                item['start_image_url'] = None
-                
-            if item.get('end_image'):
-                img_name = os.path.basename(item['end_image'])
-                item['end_image_url'] = f'/api/image/{img_name}'
-            else:
-                item['end_image_url'] = None
-        
+        results = search_batcher.search(query, top_k)
         return jsonify({'results': results})
         
     except Exception as e:
         traceback.print_exc()
         return jsonify({'error': str(e)}), 500
 
+@app.route('/api/search/stream')
+def search_stream():
+    """
+    語意搜尋（Server-Sent Events，可用 EventSource 接收）：
+    GET /api/search/stream?query=...&top_k=5
+    每讀出一筆結果送出一個 result 事件，結束時送出 done 事件，發生錯誤時送出 error 事件。
+    """
+    query = request.args.get('query', '')
+    top_k = parse_top_k(request.args.get('top_k', 5))
+    
+    if not query:
+        return jsonify({'error': '請輸入查詢文字'}), 400
+    
+    if top_k is None:
+        return jsonify({'error': f'top_k 必須是 1 到 {MAX_TOP_K} 之間的整數'}), 400
+    
+    if not rag_database_ready():
+        return jsonify({'error': '尚未建立資料庫，請先上傳並處理影片'}), 400
+    
+    def generate():
+        try:
+            # CLIP 編碼與 FAISS 搜尋交給批次處理器，只有資料庫讀取在本執行緒串流
+            scores, ids, metadata = search_batcher.search_ids(query, top_k)
+            for item in rag_query.iter_rows(scores, ids, metadata):
+                yield sse_event('result', item)
+            yield sse_event('done', {})
+        except Exception as e:
+            traceback.print_exc()
+            yield sse_event('error', {'error': str(e)})
+    
+    return Response(
+        stream_with_context(generate()),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
 @app.route('/api/image/<filename>')
 def get_image(filename):
-    """取得截圖"""
-    return send_from_directory(str(SCREENSHOTS_DIR), filename)
+    """取得截圖（支援 ETag / If-Modified-Since，快取有效時回傳 304）"""
+    path = safe_join(str(SCREENSHOTS_DIR), filename)
+    if path is None or not os.path.isfile(path):
+        abort(404)
+    return send_file(path, conditional=True, etag=True, max_age=IMAGE_MAX_AGE)
 
 if __name__ == '__main__':
+    # 開發模式：在同一行程以背景執行緒處理佇列（正式部署改為另外執行 worker.py）
+    threading.Thread(target=run_worker, daemon=True).start()
+    
     print("=" * 50)
     print("影片逐字稿理解系統 - 後端伺服器")
     print("=" * 50)
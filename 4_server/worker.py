@@ -0,0 +1,26 @@
+"""
+影片處理 worker：從 output/server_status.db 的工作佇列依序取出上傳的影片，
+執行轉錄、截圖擷取與建立索引。搭配 gunicorn 部署時與 API 伺服器分開執行：
+    python worker.py
+
+（直接執行 python server.py 的開發模式已內建同樣的處理執行緒，不需另外啟動）
+"""
+
+import os
+
+# ingest 的 CLIP 編碼使用整台機器的核心（INGEST_THREADS 可另外指定），不沿用 API worker 依 WEB_CONCURRENCY 分配的份額。
+# OpenMP / MKL 只在初始化時讀取環境變數，必須在匯入 server（及其載入的 numpy / torch / faiss）前設定；
+# server 會依 OMP_NUM_THREADS 設定 torch 與 FAISS 的執行緒數
+INGEST_THREADS = os.environ.get('INGEST_THREADS') or str(os.cpu_count() or 1)
+os.environ['OMP_NUM_THREADS'] = INGEST_THREADS
+os.environ['MKL_NUM_THREADS'] = INGEST_THREADS
+
+from server import run_worker
+import torch
+
+if __name__ == '__main__':
+    if torch.cuda.is_available():
+        # CLIP 建立索引固定在第一張 GPU 上執行
+        torch.cuda.set_device(0)
+    print("影片處理 worker 已啟動，等待工作中...")
+    run_worker()
@@ -0,0 +1,18 @@
+"""
+gunicorn 進入點：
+    WEB_CONCURRENCY=$(nproc) gunicorn -k gthread --threads 4 --preload -b 0.0.0.0:5000 wsgi:app
+
+上傳的影片由另外執行的 worker.py 處理。
+搭配 --preload 時本檔只在主行程執行一次，fork 出的 worker 以 copy-on-write 共用已載入的 FAISS 索引。
+"""
+
+import os
+
+from server import app
+import rag_query  # server 已將 3_RAG_database 加入 sys.path
+
+# 只預先載入 FAISS 索引：CLIP 推論會建立 OpenMP / CUDA 執行緒，fork 之後無法安全沿用，
+# 因此模型仍由各 worker 在第一次查詢時載入；索引搬到 GPU 同樣需要 CUDA，只在 CPU 上預載。
+# rag_query.device 由 server 設定的 PYTORCH_NVML_BASED_CUDA_CHECK 以 NVML 判斷，主行程不會因此初始化 CUDA
+if rag_query.device == 'cpu' and os.path.exists(rag_query.INDEX_PATH):
+    rag_query.get_index()